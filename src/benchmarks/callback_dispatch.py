@@ -0,0 +1,61 @@
+"""
+Compares `CallbackDispatcher` with the former chain of `startswith` checks of every button
+on the tap of an answer option, with more and more other buttons registered:
+
+    cd src && PYTHONPATH=. python benchmarks/callback_dispatch.py
+
+The other buttons are stand-ins registered only in the benchmark's own dispatcher,
+they are not added to the buttons of the bot.
+"""
+import timeit
+from types import SimpleNamespace
+
+from aiogram.types import CallbackQuery
+
+from examobot.bot.callback_dispatcher import CallbackDispatcher
+from examobot.task_translator.keyboard_task_texts import MULTIPLE_CHOICE_QUESTION_OPTION
+
+
+async def handler(call: CallbackQuery) -> None:
+    pass
+
+
+def benchmark(buttons_number: int, number: int = 100_000) -> tuple[float, float]:
+    """
+    :return: seconds per lookup of the option button registered after `buttons_number` others
+    with the dispatcher (decoding included) and with the chain of prefix checks.
+    """
+    button = MULTIPLE_CHOICE_QUESTION_OPTION
+    others = [
+        SimpleNamespace(code=code, name=f"BENCHMARK_BUTTON_{code}", callback=f"benchmark_button_{code}_callback")
+        for code in range(buttons_number + 1) if code != button.code
+    ][:buttons_number]
+
+    dispatcher = CallbackDispatcher()
+    for other in others:
+        dispatcher.register(other, handler)
+    dispatcher.register(button, handler)
+
+    callback_data = button.get_button(parameters=[123, 456]).callback_data
+    legacy_callback_data = f"{button.callback}#123#456"
+    chain_buttons = [*others, button]
+
+    def chain():
+        for chain_button in chain_buttons:
+            if legacy_callback_data.startswith(chain_button.callback):
+                return chain_button
+
+    dispatch_time = timeit.timeit(lambda: dispatcher.resolve(callback_data), number=number) / number
+    chain_time = timeit.timeit(chain, number=number // 10) / (number // 10)
+    return dispatch_time, chain_time
+
+
+def main():
+    print(f"{'buttons':>8} {'dispatcher, ns':>15} {'elif chain, ns':>15}")
+    for buttons_number in (10, 40, 100, 1000):
+        dispatch_time, chain_time = benchmark(buttons_number)
+        print(f"{buttons_number:>8} {dispatch_time * 1e9:>15.0f} {chain_time * 1e9:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Compares `SubmissionPageDetector` with the former lxml check (the whole page parsed into a tree
+and searched for forms) on pages Google Forms returned after answers were sent to it:
+
+    cd src && PYTHONPATH=. python benchmarks/response_detector.py [page.html ...]
+
+Without arguments the pages recorded in tests/fixtures/form_responses are used.
+"""
+import asyncio
+import sys
+import timeit
+from pathlib import Path
+
+from lxml import html
+
+from examobot.form_handlers.response_detector import SubmissionPageDetector, CHUNK_SIZE
+
+FIXTURES_DIR = Path(__file__).parent.parent / "tests" / "fixtures" / "form_responses"
+
+
+def detect(page: bytes) -> bool:
+    detector = SubmissionPageDetector()
+    for start in range(0, len(page), CHUNK_SIZE):
+        if detector.feed(page[start:start + CHUNK_SIZE]) is not None:
+            return detector.result
+    # neither marker is found, the page is parsed in a thread
+    return asyncio.run(detector.finish())
+
+
+def detect_with_lxml(page: bytes) -> bool:
+    return not html.fromstring(page).xpath('//form')
+
+
+def main():
+    paths = [Path(arg) for arg in sys.argv[1:]] or sorted(FIXTURES_DIR.glob("*/*.html"))
+    if not paths:
+        sys.exit(f"No pages given and none recorded in {FIXTURES_DIR}")
+
+    number = 20
+    print(f"{'page':>30} {'KiB':>6} {'accepted':>9} {'detector, ms':>13} {'lxml, ms':>9}")
+    for path in paths:
+        page = path.read_bytes()
+        accepted = detect(page)
+        assert accepted == detect_with_lxml(page), f"the detector disagrees with lxml on {path}"
+        detector_time = timeit.timeit(lambda: detect(page), number=number) / number
+        lxml_time = timeit.timeit(lambda: detect_with_lxml(page), number=number) / number
+        print(f"{path.name:>30} {len(page) // 1024:>6} {str(accepted):>9} "
+              f"{detector_time * 1e3:>13.2f} {lxml_time * 1e3:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
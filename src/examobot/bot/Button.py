@@ -2,13 +2,27 @@ from typing import Optional, Any
 
 from aiogram.types import InlineKeyboardButton
 
+from examobot.bot.callback_codec import get_button_code, encode_callback_data, decode_callback_data, \
+    CallbackDecodeError, CallbackParameter
+
 
 class Button:
     callback_suffix: str = "_callback"
 
+    # every button by its code and by its callback of the old "name_callback#param#param" format
+    _by_code: dict[int, "Button"] = {}
+    _by_callback: dict[str, "Button"] = {}
+
     def __init__(self, name: str, text: str) -> None:
         self.name = name
         self.txt = text
+        self.code = get_button_code(name)
+
+        other = Button._by_code.get(self.code)
+        if other is not None and other.name != name:
+            raise ValueError(f"Buttons {other.name} and {name} have the same code, rename one of them")
+        Button._by_code[self.code] = self
+        Button._by_callback[self.callback] = self
 
     @property
     def text(self):
@@ -22,12 +36,59 @@ class Button:
                    new_text: Optional[str] = None,
                    parameters: Optional[list[Any]] = None,
                    ) -> InlineKeyboardButton:
-        callback = self.callback
-        if parameters:
-            callback = callback + "#" + "#".join([str(p) for p in parameters])
-
+        callback = encode_callback_data(self.code, parameters or [])
         text = new_text if new_text else self.txt
         return InlineKeyboardButton(text=text, callback_data=callback)
 
     def has_that_callback(self, received_callback: str):
-        return received_callback.startswith(self.callback)
\ No newline at end of file
+        callback_data = parse_callback_data(received_callback)
+        return callback_data is not None and callback_data.button is self
+
+
+class CallbackData:
+    """
+    Decoded callback data: the pressed button and the parameters it was created with.
+    """
+
+    def __init__(self, button: Button, parameters: list[CallbackParameter]) -> None:
+        self.button = button
+        self.parameters = parameters
+
+    def __getitem__(self, index: int) -> CallbackParameter:
+        return self.parameters[index]
+
+    def __len__(self) -> int:
+        return len(self.parameters)
+
+    def __repr__(self) -> str:
+        return f"CallbackData({self.button.name}, {self.parameters})"
+
+
+def _parse_legacy_callback_data(received_callback: str) -> CallbackData | None:
+    name, *parameters = received_callback.split("#")
+    button = Button._by_callback.get(name)
+    if button is None:
+        return None
+
+    return CallbackData(button, [int(p) if p.lstrip("-").isdigit() else p for p in parameters])
+
+
+def parse_callback_data(received_callback: str) -> CallbackData | None:
+    """
+    :return: Decoded callback data, None if it doesn't belong to any button.
+    """
+    # buttons of messages sent before the compact encoding
+    legacy = _parse_legacy_callback_data(received_callback)
+    if legacy is not None:
+        return legacy
+
+    try:
+        code, parameters = decode_callback_data(received_callback)
+    except CallbackDecodeError:
+        return None
+
+    button = Button._by_code.get(code)
+    if button is None:
+        return None
+
+    return CallbackData(button, parameters)
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramAPIError
+from cachetools import TTLCache
+
+from examobot.db.manager import db_manager
+from examobot.db.tables import Broadcast, BroadcastStatus
+from examobot.definitions import BROADCAST_RATE, BROADCAST_CHAT_RATE, BROADCAST_BATCH_SIZE
+
+NETWORK_RETRIES = 3
+NETWORK_RETRY_DELAY = 1.0
+# seconds a broadcast stays with the process that sends it, the lease is renewed after every batch
+LEASE = 2 * 60
+# how often broadcasts left by other processes (stopped or crashed) are looked for, in seconds
+CLAIM_INTERVAL = 60
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average and bursts of at most `capacity` of them.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        # the lock makes waiters take tokens in the order they came
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """
+        Nothing is acquired for the next `seconds`.
+        """
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class Broadcaster:
+    """
+    Sends one message to many users in the background as fast as Telegram allows:
+    at most `BROADCAST_RATE` messages per second overall and `BROADCAST_CHAT_RATE` to one chat.
+    On `TelegramRetryAfter` all the sending is paused for the requested time and the message is retried.
+
+    The progress is saved every `BROADCAST_BATCH_SIZE` messages, so a broadcast interrupted by
+    a restart is resumed from the last saved batch (its messages may be delivered twice).
+    When a broadcast ends, its author gets a report.
+
+    A broadcast is sent by one process at a time: the process holds a lease on it and renews it
+    after every batch. Unfinished broadcasts whose lease has ended (their process stopped) are taken
+    on startup and every `CLAIM_INTERVAL` seconds.
+    """
+
+    def __init__(self) -> None:
+        self._bucket = TokenBucket(BROADCAST_RATE, capacity=BROADCAST_RATE)
+        # buckets of chats that got a message recently, shared by all the broadcasts
+        self._chat_buckets: TTLCache[int, TokenBucket] = TTLCache(maxsize=100_000, ttl=60)
+        self._running: dict[int, asyncio.Task] = {}
+        self._claim_task: asyncio.Task | None = None
+
+    async def start(self, bot: Bot, author_id: int, text: str, recipient_ids: list[int]) -> Broadcast | None:
+        """
+        Saves the broadcast and starts sending after the current unit of work is committed.
+        Returns immediately, None if there is nobody to send to.
+        """
+        if not recipient_ids:
+            return None
+
+        broadcast = await db_manager.add_broadcast(
+            author_id, text, recipient_ids, locked_until=int(time.time()) + LEASE)
+        db_manager.call_on_commit(lambda: self._schedule(bot, broadcast))
+        return broadcast
+
+    async def resume(self, bot: Bot) -> None:
+        """
+        Continues broadcasts that were not finished before the restart and, from then on,
+        the ones other processes leave.
+        """
+        if self._claim_task is None:
+            self._claim_task = db_manager.create_background_task(self._claim_periodically(bot))
+
+    async def _claim_periodically(self, bot: Bot) -> None:
+        while True:
+            try:
+                for broadcast in await db_manager.claim_unfinished_broadcasts(now=int(time.time()), lease=LEASE):
+                    logging.info(f"Resuming broadcast {broadcast.id} from message {broadcast.processed_count}")
+                    self._schedule(bot, broadcast)
+            except Exception:
+                logging.exception("Failed to take unfinished broadcasts")
+            await asyncio.sleep(CLAIM_INTERVAL)
+
+    async def close(self) -> None:
+        tasks = list(self._running.values())
+        if self._claim_task is not None:
+            tasks.append(self._claim_task)
+            self._claim_task = None
+        broadcast_ids = list(self._running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # other processes may continue them right away
+        for broadcast_id in broadcast_ids:
+            await db_manager.update_broadcast_by_id(broadcast_id, locked_until=0)
+
+    def _schedule(self, bot: Bot, broadcast: Broadcast) -> None:
+        if broadcast.id in self._running:
+            return
+
+        task = db_manager.create_background_task(self._run(bot, broadcast))
+        self._running[broadcast.id] = task
+        task.add_done_callback(lambda _: self._running.pop(broadcast.id, None))
+
+    async def _run(self, bot: Bot, broadcast: Broadcast) -> None:
+        try:
+            recipient_ids = broadcast.recipient_ids
+            while broadcast.processed_count < len(recipient_ids):
+                batch = recipient_ids[broadcast.processed_count:broadcast.processed_count + BROADCAST_BATCH_SIZE]
+                results = await asyncio.gather(*(self._send(bot, chat_id, broadcast.text) for chat_id in batch))
+
+                broadcast.processed_count += len(batch)
+                broadcast.delivered_count += sum(results)
+                broadcast.failed_count += len(batch) - sum(results)
+                await db_manager.update_broadcast_by_id(
+                    broadcast.id,
+                    processed_count=broadcast.processed_count,
+                    delivered_count=broadcast.delivered_count,
+                    failed_count=broadcast.failed_count,
+                    locked_until=int(time.time()) + LEASE,
+                )
+
+            await self._send(
+                bot, broadcast.author_id,
+                f"Рассылка завершена: доставлено {broadcast.delivered_count} из {len(recipient_ids)}"
+            )
+            await db_manager.update_broadcast_by_id(broadcast.id, status=BroadcastStatus.FINISHED)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # the broadcast stays unfinished: when its lease ends (`LEASE`), a process that claims
+            # unfinished broadcasts (this one or another) takes it and resumes it from `processed_count`
+            logging.exception(f"Broadcast {broadcast.id} failed")
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(BROADCAST_CHAT_RATE, capacity=1)
+        return bucket
+
+    async def _send(self, bot: Bot, chat_id: int, text: str) -> bool:
+        """
+        :return: whether the message was delivered.
+        """
+        network_retries = 0
+        while True:
+            await self._get_chat_bucket(chat_id).acquire()
+            await self._bucket.acquire()
+            try:
+                await bot.send_message(chat_id, text=text)
+                return True
+            except TelegramRetryAfter as e:
+                self._bucket.pause(e.retry_after)
+            except TelegramNetworkError:
+                if network_retries == NETWORK_RETRIES:
+                    logging.warning(f"Failed to send a broadcast message to {chat_id}: network error")
+                    return False
+                network_retries += 1
+                await asyncio.sleep(NETWORK_RETRY_DELAY * network_retries)
+            except TelegramAPIError as e:
+                # the user blocked the bot, deleted the account, etc.
+                logging.info(f"Failed to send a broadcast message to {chat_id}: {e.message}")
+                return False
+
+
+broadcaster = Broadcaster()
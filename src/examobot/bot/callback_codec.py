@@ -0,0 +1,106 @@
+"""
+Compact encoding of callback data.
+
+Telegram allows at most 64 bytes of callback data, so a button is identified by a 2-byte code
+and its parameters are packed as varints:
+    - int: zigzag-encoded value shifted left by one bit (the lowest bit is 0);
+    - str: UTF-8 length shifted left by one bit with the lowest bit set, then the UTF-8 bytes.
+The result is encoded with URL-safe base64 without padding.
+
+For example, a button with parameters [123456, 7] takes 8 characters instead of
+49 of `multiple_choice_question_option_callback#123456#7`.
+"""
+import base64
+import binascii
+import zlib
+
+MAX_CALLBACK_DATA_LENGTH = 64
+BUTTON_CODE_SIZE = 2
+
+CallbackParameter = int | str
+
+
+class CallbackDecodeError(ValueError):
+    pass
+
+
+def get_button_code(name: str) -> int:
+    """
+    The code depends only on the name, so the buttons of already sent messages keep working after a restart.
+    """
+    return zlib.crc32(name.encode()) & 0xFFFF
+
+
+def _write_varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise CallbackDecodeError("Unexpected end of callback data")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_callback_data(button_code: int, parameters: list[CallbackParameter]) -> str:
+    out = bytearray(button_code.to_bytes(BUTTON_CODE_SIZE, "big"))
+    for parameter in parameters:
+        # bool is an int, but it is not expected here
+        if isinstance(parameter, int) and not isinstance(parameter, bool):
+            zigzag = parameter << 1 if parameter >= 0 else (-parameter << 1) - 1
+            _write_varint(zigzag << 1, out)
+        elif isinstance(parameter, str):
+            encoded = parameter.encode()
+            _write_varint(len(encoded) << 1 | 1, out)
+            out += encoded
+        else:
+            raise TypeError(f"Callback parameter can be int or str, found: {type(parameter)}")
+
+    callback_data = base64.urlsafe_b64encode(out).rstrip(b"=").decode()
+    if len(callback_data) > MAX_CALLBACK_DATA_LENGTH:
+        raise ValueError(f"Callback data is longer than {MAX_CALLBACK_DATA_LENGTH} bytes: {parameters}")
+    return callback_data
+
+
+def decode_callback_data(callback_data: str) -> tuple[int, list[CallbackParameter]]:
+    """
+    :return: Code of the button and its parameters.
+    :raises CallbackDecodeError: If `callback_data` is not made by `encode_callback_data`.
+    """
+    try:
+        data = base64.urlsafe_b64decode(callback_data + "=" * (-len(callback_data) % 4))
+    except (binascii.Error, ValueError) as e:
+        raise CallbackDecodeError(f"Invalid callback data: {callback_data}") from e
+
+    if len(data) < BUTTON_CODE_SIZE:
+        raise CallbackDecodeError(f"Invalid callback data: {callback_data}")
+
+    button_code = int.from_bytes(data[:BUTTON_CODE_SIZE], "big")
+    parameters = []
+    pos = BUTTON_CODE_SIZE
+    while pos < len(data):
+        header, pos = _read_varint(data, pos)
+        if header & 1:
+            end = pos + (header >> 1)
+            if end > len(data):
+                raise CallbackDecodeError("Unexpected end of callback data")
+            try:
+                parameters.append(data[pos:end].decode())
+            except UnicodeDecodeError as e:
+                raise CallbackDecodeError(f"Invalid callback data: {callback_data}") from e
+            pos = end
+        else:
+            zigzag = header >> 1
+            parameters.append(zigzag >> 1 if not zigzag & 1 else -((zigzag + 1) >> 1))
+
+    return button_code, parameters
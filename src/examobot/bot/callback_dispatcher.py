@@ -0,0 +1,56 @@
+import inspect
+from typing import Any, Awaitable, Callable
+
+from aiogram.types import CallbackQuery
+
+from examobot.bot.Button import Button, CallbackData, parse_callback_data
+
+CallbackHandler = Callable[..., Awaitable[Any]]
+
+
+class CallbackDispatcher:
+    """
+    Finds the handler of a callback query by the code of the button it came from,
+    so the cost of a dispatch doesn't depend on the number of buttons.
+
+    Handlers take the query as the first argument and any of the keyword arguments
+    passed to `dispatch` by name, e.g. `state`. The decoded callback data is passed
+    as `callback_data`, so it is parsed only once per query.
+    """
+
+    def __init__(self) -> None:
+        # button code -> (handler, names of the keyword arguments it takes)
+        self._handlers: dict[int, tuple[CallbackHandler, tuple[str, ...]]] = {}
+
+    def register(self, button: Button, handler: CallbackHandler) -> None:
+        if button.code in self._handlers:
+            raise ValueError(f"Handler for {button.name} is already registered")
+
+        parameters = list(inspect.signature(handler).parameters.values())[1:]
+        self._handlers[button.code] = (handler, tuple(p.name for p in parameters))
+
+    def resolve(self, received_callback: str) -> tuple[CallbackHandler, tuple[str, ...], CallbackData] | None:
+        callback_data = parse_callback_data(received_callback)
+        if callback_data is None:
+            return None
+
+        resolved = self._handlers.get(callback_data.button.code)
+        if resolved is None:
+            return None
+
+        handler, argument_names = resolved
+        return handler, argument_names, callback_data
+
+    async def dispatch(self, call: CallbackQuery, **kwargs: Any) -> bool:
+        """
+        :return: whether there is a handler for the query.
+        """
+        resolved = self.resolve(call.data)
+        if resolved is None:
+            return False
+
+        handler, argument_names, callback_data = resolved
+        kwargs["callback_data"] = callback_data
+        await handler(call, **{name: kwargs[name] for name in argument_names if name in kwargs})
+        return True
+
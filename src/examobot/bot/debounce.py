@@ -0,0 +1,44 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Hashable
+
+from aiogram.exceptions import TelegramBadRequest
+
+from examobot.db.manager import db_manager
+
+
+class Debouncer:
+    """
+    Runs an action `delay` seconds after it is scheduled. An action scheduled with the same key
+    meanwhile replaces it and starts the delay again, so a burst of them ends with one call
+    of the last one, `delay` seconds after it.
+    """
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        # key -> (the last scheduled action, when it was scheduled)
+        self._pending: dict[Hashable, tuple[Callable[[], Awaitable[None]], float]] = {}
+
+    def schedule(self, key: Hashable, action: Callable[[], Awaitable[None]]) -> None:
+        already_scheduled = key in self._pending
+        self._pending[key] = (action, time.monotonic())
+        if not already_scheduled:
+            db_manager.create_background_task(self._run(key))
+
+    async def _run(self, key: Hashable) -> None:
+        while True:
+            _, scheduled_at = self._pending[key]
+            remaining = scheduled_at + self.delay - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+
+        action, _ = self._pending.pop(key)
+        try:
+            await action()
+        except TelegramBadRequest as e:
+            # e.g. the message is not modified or has been deleted
+            logging.debug(f"Debounced action {key} failed: {e.message}")
+        except Exception:
+            logging.exception(f"Debounced action {key} failed")
@@ -0,0 +1,96 @@
+import hashlib
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageText, EditMessageReplyMarkup, SendMessage, TelegramMethod
+from aiogram.methods.base import Response
+from aiogram.types import InlineKeyboardMarkup, Message
+from cachetools import LRUCache
+
+from examobot.definitions import EDITED_MESSAGES_CACHE_SIZE, BOT_PROCESSES
+
+NOT_MODIFIED_ERROR = "message is not modified"
+
+
+def _hash(value: str) -> bytes:
+    return hashlib.blake2b(value.encode(), digest_size=16).digest()
+
+
+def _hash_text(method: SendMessage | EditMessageText) -> bytes:
+    return _hash(repr((method.text, method.parse_mode, method.entities, method.disable_web_page_preview)))
+
+
+def _hash_markup(markup: Any) -> bytes:
+    if isinstance(markup, InlineKeyboardMarkup):
+        return _hash(markup.model_dump_json(exclude_none=True))
+    return _hash(repr(markup))
+
+
+class UnchangedEditsMiddleware(BaseRequestMiddleware):
+    """
+    Skips edits of messages that wouldn't change them: Telegram rejects those with
+    "message is not modified" after a full round trip.
+
+    Hashes of the text and of the keyboard of the last `EDITED_MESSAGES_CACHE_SIZE` sent or edited
+    messages are kept; an edit with the same hashes is answered with `True` without a request.
+    Other requests about a message (e.g. deleting it) forget it.
+    The hashes are trusted only when the process is `authoritative` (the only one sending to the chats):
+    otherwise another process could have edited the message meanwhile, so every edit is sent
+    and just "message is not modified" errors are turned into `True`.
+
+    skipped      - edits that were not sent
+    not_modified - edits rejected by Telegram as not changing the message (the cache didn't know it)
+    """
+
+    def __init__(self, cache_size: int = EDITED_MESSAGES_CACHE_SIZE, authoritative: bool = BOT_PROCESSES == 1) -> None:
+        self.authoritative = authoritative
+        # (chat id, message id) -> (hash of the text, hash of the keyboard)
+        self._rendered: LRUCache[tuple[int | str, int], tuple[bytes | None, bytes]] = LRUCache(maxsize=cache_size)
+        self.skipped = 0
+        self.not_modified = 0
+
+    def stats(self) -> dict[str, int]:
+        return {"skipped": self.skipped, "not_modified": self.not_modified, "cached": len(self._rendered)}
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Response:
+        if isinstance(method, SendMessage):
+            response = await make_request(bot, method)
+            if isinstance(response.result, Message):
+                key = (method.chat_id, response.result.message_id)
+                self._rendered[key] = (_hash_text(method), _hash_markup(method.reply_markup))
+            return response
+
+        chat_id, message_id = getattr(method, "chat_id", None), getattr(method, "message_id", None)
+        if chat_id is None or message_id is None:
+            return await make_request(bot, method)
+
+        key = (chat_id, message_id)
+        if isinstance(method, EditMessageText):
+            rendered = (_hash_text(method), _hash_markup(method.reply_markup))
+        elif isinstance(method, EditMessageReplyMarkup):
+            text_hash, _ = self._rendered.get(key, (None, None))
+            rendered = (text_hash, _hash_markup(method.reply_markup))
+        else:
+            self._rendered.pop(key, None)
+            return await make_request(bot, method)
+
+        if self.authoritative and self._rendered.get(key) == rendered:
+            self.skipped += 1
+            return Response(ok=True, result=True)
+
+        try:
+            response = await make_request(bot, method)
+        except TelegramBadRequest as e:
+            if NOT_MODIFIED_ERROR not in e.message:
+                self._rendered.pop(key, None)
+                raise
+            self.not_modified += 1
+            response = Response(ok=True, result=True)
+
+        self._rendered[key] = rendered
+        return response
+
+
+unchanged_edits_middleware = UnchangedEditsMiddleware()
@@ -3,27 +3,57 @@ import os
 import re
 import time
 from datetime import datetime
+from functools import partial
 from pprint import pprint
 
 from aiogram import Dispatcher
 from aiogram.filters import CommandStart, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
+from aiogram.fsm.storage.memory import SimpleEventIsolation
+from sqlalchemy import Row
 
+from examobot.bot.Button import CallbackData
+from examobot.bot.broadcast import broadcaster
+from examobot.bot.callback_dispatcher import CallbackDispatcher
 from examobot.bot.consts import *
 from examobot.bot.examobot_tasks import tasks_router, handle_one_choice_question_option_query, \
     handle_multiple_choice_question_option_query
+from examobot.bot.form_submission import form_submitter
+from examobot.bot.fsm_storage import create_fsm_storage, DBStorage
 from examobot.bot.keyboards import *
+from examobot.bot.middlewares import DBSessionMiddleware, UserOrderingMiddleware, CurrentUserMiddleware
+from examobot.bot.navigation import navigation_store
+from examobot.bot.user_context import UserContext
 from examobot.db.tables import *
 from examobot.definitions import BOT_NAME
 from examobot.form_handlers import *
-from examobot.form_handlers.exceptions import JSONParseError, URLFailedCreationError, BadRequestError, HTMLParseError, \
-    TestCompleteFailError
+from examobot.form_handlers.http_session import forms_http_session
 from examobot.task_translator.question_type import QuestionType
 from examobot.task_translator.questions_classes import *
 from examobot.task_translator.task_translator import Translator, TranslationError
 
-dp = Dispatcher()
+fsm_storage = create_fsm_storage()
+# the state of a user is loaded under a per-key lock
+dp = Dispatcher(storage=fsm_storage, events_isolation=SimpleEventIsolation())
+# the dispatcher registers its FSM middleware first, it has to load the state after the previous
+# update of the user is handled, so it goes after the ordering
+dp.update.outer_middleware.unregister(dp.fsm)
+dp.update.outer_middleware(UserOrderingMiddleware())
+dp.update.outer_middleware(dp.fsm)
+dp.update.outer_middleware(DBSessionMiddleware())
+dp.update.outer_middleware(CurrentUserMiddleware())
+if isinstance(fsm_storage, DBStorage):
+    dp.startup.register(fsm_storage.start)
+    dp.shutdown.register(fsm_storage.close)
+dp.startup.register(broadcaster.resume)
+dp.shutdown.register(broadcaster.close)
+dp.startup.register(navigation_store.start)
+dp.shutdown.register(navigation_store.close)
+dp.startup.register(forms_http_session.start)
+dp.startup.register(form_submitter.start)
+dp.shutdown.register(form_submitter.close)
+dp.shutdown.register(forms_http_session.close)
 dp.include_router(tasks_router)
 
 
@@ -153,30 +183,16 @@ class Validations:
         return text.strip()
 
 
-def get_user_name(user: types.User) -> str:
-    name = ""
-    if user.first_name:
-        name += user.first_name
-    if user.last_name:
-        name += f" {user.last_name}"
-    return name
-
-
 @dp.message(CommandStart())
-async def welcome_message(message: types.Message, command: CommandObject) -> None:
-    name = get_user_name(message.from_user)
-    exists = await db_manager.check_if_user_exists(user_id=message.from_user.id)
+async def welcome_message(message: types.Message, command: CommandObject, user_context: UserContext) -> None:
     args = command.args
 
-    if not exists:
-        await db_manager.add_user(message.from_user.id, message.from_user.username, name=name)
+    # the user may have been added by an earlier update that wasn't /start
+    if not user_context.user.greeted:
         await message.bot.send_message(message.from_user.id, START_TEXT)
+        user_context.update(greeted=True)
 
-    await db_manager.update_user_by_id(
-        message.from_user.id,
-        current_task_id=None,
-        current_test_id=None,
-    )
+    user_context.update(current_task_id=None, current_test_id=None)
 
     if not args:
         await message.bot.send_message(
@@ -250,227 +266,98 @@ async def welcome_message(message: types.Message, command: CommandObject) -> Non
 
 
 @dp.callback_query()
-async def callback_inline(call: types.CallbackQuery, state: FSMContext) -> None:
-    # main menu authors options
-
-    if BACK_TO_MAIN_MENU.has_that_callback(call.data):
-        await call.bot.edit_message_text(
-            MAIN_MENU_TEXT,
-            call.from_user.id,
-            call.message.message_id,
-            reply_markup=get_main_menu_keyboard()
-        )
-
-    # CREATED CLASSROOMS
-
-    elif AUTHORS_CLASSROOMS.has_that_callback(call.data):
-        await handle_authors_classrooms_query(call)
-
-    elif CREATE_CLASSROOM.has_that_callback(call.data):
-        await handle_create_classroom_query(call, state)
-
-    elif EDIT_CLASSROOM.has_that_callback(call.data):
-        await handle_edit_classroom_query(call)
-
-    elif EDIT_CLASSROOM_TITLE.has_that_callback(call.data):
-        await handle_edit_classroom_title_query(call, state)
-
-    # CREATED TESTS
-
-    elif CREATE_TEST.has_that_callback(call.data):
-        await handle_create_test_query(call, state)
-
-    elif SAVE_TEST.has_that_callback(call.data):
-        await handle_save_test_query(call, state)
-
-    elif SAVE_TEST_WITH_ADDITIONALS.has_that_callback(call.data):
-        await handle_save_test_with_additionals_query(call, state)
-
-    elif CANCEL_ADDITION.has_that_callback(call.data):
-        await handle_cancel_addition_query(call, state)
-
-    elif EDIT_TEST.has_that_callback(call.data):
-        await handle_edit_test_query(call, state)
-
-    elif EDIT_TEST_TITLE.has_that_callback(call.data):
-        await handle_edit_test_title_query(call, state)
-
-    elif EDIT_TEST_TIME.has_that_callback(call.data):
-        await handle_edit_test_time_query(call, state)
-
-    elif EDIT_TEST_DEADLINE.has_that_callback(call.data):
-        await handle_edit_test_deadline_query(call, state)
-
-    elif EDIT_TEST_ATTEMPTS_NUMBER.has_that_callback(call.data):
-        await handle_edit_test_attempts_number_query(call, state)
+async def callback_inline(call: types.CallbackQuery, state: FSMContext, user_context: UserContext) -> None:
+    await callback_dispatcher.dispatch(call, state=state, user_context=user_context)
 
-    elif EDIT_TEST_LINK.has_that_callback(call.data):
-        await handle_edit_test_link_query(call, state)
 
-    elif AUTHORS_TESTS.has_that_callback(call.data):
-        await handle_authors_tests_query(call, state)
-
-    elif SPEC_CREATED_TEST.has_that_callback(call.data):
-        await handle_spec_created_test_query(call, state)
-
-    elif SHARE_TEST_LINK.has_that_callback(call.data):
-        await handle_share_test_link_query(call)
-
-    elif SHARE_TEST_LINK_TO_CLASSROOM.has_that_callback(call.data):
-        await handle_share_test_link_to_classroom_query(call)
-
-    elif SPEC_SHARE_TEST_LINK_TO_CLASSROOM.has_that_callback(call.data):
-        await handle_spec_share_test_link_to_classroom_query(call)
-
-    elif SPEC_CREATED_CLASSROOM.has_that_callback(call.data):
-        await handle_spec_created_classroom_query(call)
+async def handle_back_to_main_menu_query(call: types.CallbackQuery) -> None:
+    await call.bot.edit_message_text(
+        MAIN_MENU_TEXT,
+        call.from_user.id,
+        call.message.message_id,
+        reply_markup=get_main_menu_keyboard()
+    )
 
-    elif SHOW_CLASSROOM_PARTICIPANTS.has_that_callback(call.data):
-        await handle_show_classroom_participants_query(call)
 
-    elif DELETE_CLASSROOM.has_that_callback(call.data):
-        await handle_delete_classroom_query(call)
+async def handle_current_tests_query(call: types.CallbackQuery) -> None:
+    await call.bot.edit_message_text(
+        "Какие опросы показать?",
+        call.from_user.id,
+        call.message.message_id,
+        reply_markup=get_current_tests_menu_keyboard())
 
-    elif DELETE_ENTITY_CONFIRM.has_that_callback(call.data):
-        await handle_delete_entity_confirm_query(call)
 
-    elif CLOSE_TEST.has_that_callback(call.data):
-        await handle_change_test_status_query(call, TestStatus.UNAVAILABLE)
+def build_google_form_answers(answers: list[Row]) -> dict[int, FormResponseParameters]:
+    """
+    :param answers: Rows of `db_manager.get_answers_with_tasks_by_test_id_and_user_id`.
+    :return: Dictionary where keys are IDs of question items in dec format and values are the answers.
+    """
+    google_form_answers = dict()
+    for answer in answers:
+        question = QuestionType[answer.task_type].value
+        decimal_google_question_id = int(answer.google_form_question_id, 16)
+        google_form_answers[decimal_google_question_id] = question.convert_answer_to_string_repr(
+            answer.answer_data, answer.options)
 
-    elif OPEN_TEST.has_that_callback(call.data):
-        await handle_change_test_status_query(call, TestStatus.AVAILABLE)
+    return google_form_answers
 
-    elif REFRESH_TEST_DATA.has_that_callback(call.data):
-        await handle_refresh_test_data_query(call)
 
-    elif DELETE_TEST.has_that_callback(call.data):
-        await handle_delete_test_query(call)
+async def handle_end_test_query(call: CallbackQuery, user_context: UserContext):
+    user_id = call.from_user.id
+    cur_test_id = user_context.current_test_id
 
-    # CURRENT TESTS
+    answers = await db_manager.get_answers_with_tasks_by_test_id_and_user_id(test_id=cur_test_id, user_id=user_id)
+    google_form_answers = build_google_form_answers(answers)
 
-    elif CURRENT_TESTS.has_that_callback(call.data):
+    # committed together with deleting the answers, `form_submitter` sends them after the commit
+    added = await form_submitter.submit(
+        # the same tap can't finish the test twice, e.g. when Telegram delivers its update again
+        idempotency_key=f"{user_id}:{cur_test_id}:{call.id}",
+        user_id=user_id,
+        test_id=cur_test_id,
+        answers=google_form_answers,
+    )
+    if not added:
+        # the same tap was delivered again, its first delivery has already queued the answers
         await call.bot.edit_message_text(
-            "Какие опросы показать?",
-            call.from_user.id,
-            call.message.message_id,
-            reply_markup=get_current_tests_menu_keyboard())
-
-    elif CURRENT_AVAILABLE_TEST_WITH_ATTEMPTS.has_that_callback(call.data):
-        await handle_current_available_test_with_attempts_query(call)
-
-    elif CURRENT_ENDED_OR_WITH_NO_ATTEMPTS_TESTS.has_that_callback(call.data):
-        await handle_current_ended_or_with_no_attempts_tests_query(call)
-
-    elif SPEC_CURRENT_TEST.has_that_callback(call.data):
-        await handle_spec_current_test_query(call)
-
-    elif START_CURRENT_TEST.has_that_callback(call.data):
-        await handle_start_current_test_query(call)
-
-    elif SPEC_CURRENT_TEST_TASK.has_that_callback(call.data):
-        await handle_spec_current_test_task_query(call)
-
-    elif BACK_TO_TEST_QUESTIONS_FROM_TASK.has_that_callback(call.data):
-        await handle_back_to_test_questions_from_task_query(call)
-
-    elif BACK_TO_QUESTION_TEXT.has_that_callback(call.data):
-        await handle_back_to_question_text_query(call)
-
-    elif END_TEST.has_that_callback(call.data):
-        await handle_end_test_query(call)
-
-    # QUESTIONS
-
-    elif ONE_CHOICE_QUESTION_OPTION.has_that_callback(call.data):
-        await handle_one_choice_question_option_query(call)
-
-    elif MULTIPLE_CHOICE_QUESTION_OPTION.has_that_callback(call.data):
-        await handle_multiple_choice_question_option_query(call)
-
-    # CURRENT CLASSROOMS
-
-    elif CURRENT_CLASSROOMS.has_that_callback(call.data):
-        await handle_current_classrooms_query(call)
-
-    elif SPEC_CURRENT_CLASSROOM.has_that_callback(call.data):
-        await handle_spec_current_classroom_query(call)
-
+            text="Тест уже завершён, ответы отправляются",
+            chat_id=call.from_user.id,
+            message_id=call.message.message_id,
+            reply_markup=get_back_to_main_menu_keyboard()
+        )
+        return
 
-async def send_end_test_error(call: CallbackQuery, test: Test, text: str):
-    tasks = await db_manager.get_tasks_by_test_id(test_id=test.id)
+    await db_manager.delete_answers_by_test_id_and_user_id(test_id=cur_test_id, user_id=user_id)
     await call.bot.edit_message_text(
-        text=text,
+        text="Тест завершён, ответы отправляются",
         chat_id=call.from_user.id,
         message_id=call.message.message_id,
-        reply_markup=get_current_test_tasks_keyboard(tasks=tasks)
+        reply_markup=get_back_to_main_menu_keyboard()
     )
 
 
-async def handle_end_test_query(call: CallbackQuery):
-    user_id = call.from_user.id
-    user = await db_manager.get_user_by_id(user_id)
-    cur_test_id = user.current_test_id
-    cur_task_id = user.current_task_id
-
-    google_form_answers = dict()
-    answers = await db_manager.get_answers_by_test_id_and_user_id(test_id=cur_test_id, user_id=user_id)
-    for answer in answers:
-        task = await db_manager.get_task_by_id(task_id=answer.task_id)
-        question = QuestionType[task.task_type].value
-        decimal_google_question_id = int(task.google_form_question_id, 16)
-        google_form_answers[decimal_google_question_id] = question.convert_answer_to_string_repr(answer, task)
-
-    await db_manager.delete_answers_by_test_id_and_user_id(test_id=cur_test_id, user_id=user_id)
-    test = await db_manager.get_test_by_id(cur_test_id)
-    answer_sender = FormAnswerSender()
-    try:
-        await answer_sender.send_answer_metadata(test.meta_data, google_form_answers)
-        await call.bot.edit_message_text(
-            text="Тест завершён",
-            chat_id=call.from_user.id,
-            message_id=call.message.message_id,
-            reply_markup=get_back_to_main_menu_keyboard()
-        )
-    except JSONParseError as exception:
-        pprint(str(exception))
-        await send_end_test_error(call, test, text="unfortunately, some error occurred. try send later")
-    except URLFailedCreationError as exception:
-        pprint(str(exception))
-        await send_end_test_error(call, test, text="unfortunately, some error with test data occurred.")
-    except BadRequestError as exception:
-        pprint(str(exception))
-        await send_end_test_error(call, test, text="unfortunately, some error with connection occurred.")
-    except HTMLParseError as exception:
-        pprint(str(exception))
-        await send_end_test_error(call, test, text="unfortunately, some error occurred.")
-    except TestCompleteFailError as exception:
-        pprint(str(exception))
-        await send_end_test_error(call, test, text="unfortunately, some error occurred.")
-
-
-async def delete_question_messages(bot: Bot, user_id: int):
-    user = await db_manager.get_user_by_id(user_id)
-    if user.current_messages_to_delete:
-        for message_id in user.current_messages_to_delete:
+async def delete_question_messages(bot: Bot, user_context: UserContext):
+    if user_context.current_messages_to_delete:
+        for message_id in user_context.current_messages_to_delete:
             try:
-                await bot.delete_message(user_id, message_id)
+                await bot.delete_message(user_context.id, message_id)
             except Exception:
                 pass
 
-        await db_manager.update_user_by_id(user_id, current_messages_to_delete=[])
+        user_context.update(current_messages_to_delete=[])
 
 
-async def handle_back_to_question_text_query(call: types.CallbackQuery):
-    user_id = call.from_user.id
-    await delete_question_messages(bot=call.bot, user_id=user_id)
+async def handle_back_to_question_text_query(call: types.CallbackQuery, user_context: UserContext):
+    await delete_question_messages(bot=call.bot, user_context=user_context)
 
 
-async def handle_back_to_test_questions_from_task_query(call: types.CallbackQuery):
+async def handle_back_to_test_questions_from_task_query(call: types.CallbackQuery, callback_data: CallbackData,
+                                                        user_context: UserContext):
     user_id = call.from_user.id
-    await db_manager.update_user_by_id(user_id, current_task_id=None)
-    await delete_question_messages(bot=call.bot, user_id=user_id)
+    user_context.update(current_task_id=None)
+    await delete_question_messages(bot=call.bot, user_context=user_context)
 
-    test_id = get_test_id_or_classroom_id_from_callback(call.data)
+    test_id = get_test_id_or_classroom_id_from_callback(callback_data)
     test = await db_manager.get_test_by_id(test_id)
     if not test:
         await call.bot.edit_message_text(
@@ -490,9 +377,10 @@ async def handle_back_to_test_questions_from_task_query(call: types.CallbackQuer
     )
 
 
-async def handle_spec_current_test_task_query(call: types.CallbackQuery):
+async def handle_spec_current_test_task_query(call: types.CallbackQuery, callback_data: CallbackData,
+                                              user_context: UserContext):
     user_id = call.from_user.id
-    task_id = get_test_id_or_classroom_id_from_callback(call.data)
+    task_id = get_test_id_or_classroom_id_from_callback(callback_data)
     task = await db_manager.get_task_by_id(task_id)
     if not task:
         await call.bot.edit_message_text(
@@ -512,22 +400,19 @@ async def handle_spec_current_test_task_query(call: types.CallbackQuery):
     )
 
     message_ids_to_delete = [msg.message_id for msg in messages_to_delete if msg is not None]
-    await db_manager.update_user_by_id(
-        user_id,
-        current_task_id=task_id,
-        current_messages_to_delete=message_ids_to_delete
-    )
+    user_context.update(current_task_id=task_id, current_messages_to_delete=message_ids_to_delete)
     # TODO Add a new field to Users table: current_task_message
 
 
-async def handle_start_current_test_query(call: types.CallbackQuery):
-    test_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_start_current_test_query(call: types.CallbackQuery, callback_data: CallbackData,
+                                          user_context: UserContext):
+    test_id = get_test_id_or_classroom_id_from_callback(callback_data)
     test = await db_manager.get_test_by_id(test_id)
     tasks: list[Task] = await db_manager.get_tasks_by_test_id(test_id)
     # todo check if user has no attempts left
     # todo check deadline test
     # todo add start timer
-    await db_manager.update_user_by_id(call.from_user.id, current_test_id=test_id)
+    user_context.update(current_test_id=test_id)
     await call.bot.edit_message_text(
         test.title,
         call.from_user.id,
@@ -541,9 +426,11 @@ async def write_json_to_file(data):
         f.write(data)
 
 
-async def handle_refresh_test_data_query(call: types.CallbackQuery):
-    test_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_refresh_test_data_query(call: types.CallbackQuery, callback_data: CallbackData):
+    test_id = get_test_id_or_classroom_id_from_callback(callback_data)
     test = await db_manager.get_test_by_id(test_id)
+    # loading the form may take minutes, the connection of the update shouldn't wait for it
+    await db_manager.commit()
     meta_data = await FormExtractor.extract_string(form_url=test.link)
     if not meta_data:
         await call.bot.edit_message_text(
@@ -559,15 +446,16 @@ async def handle_refresh_test_data_query(call: types.CallbackQuery):
         reply_markup=go_to_previous_menu_keyboard(SPEC_CREATED_TEST, [test_id]))
 
 
-async def handle_edit_classroom_title_query(call: types.CallbackQuery, state: FSMContext) -> None:
-    classroom_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_edit_classroom_title_query(call: types.CallbackQuery,
+                                            callback_data: CallbackData, state: FSMContext) -> None:
+    classroom_id = get_test_id_or_classroom_id_from_callback(callback_data)
     await call.bot.edit_message_text("Введите название", call.from_user.id, call.message.message_id)
     await state.set_state(Form.edit_classroom_title)
     await state.update_data(edit_classroom_id=classroom_id)
 
 
-async def handle_edit_classroom_query(call: types.CallbackQuery):
-    classroom_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_edit_classroom_query(call: types.CallbackQuery, callback_data: CallbackData):
+    classroom_id = get_test_id_or_classroom_id_from_callback(callback_data)
     classroom = await db_manager.get_classroom_by_id(classroom_id)
     await call.bot.edit_message_text(
         f"Изменить группу \"{classroom.title}\"",
@@ -593,8 +481,8 @@ async def check_test_or_classroom_was_deleted_and_inform_user(
     return True
 
 
-async def handle_spec_current_test_query(call: types.CallbackQuery):
-    test_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_spec_current_test_query(call: types.CallbackQuery, callback_data: CallbackData):
+    test_id = get_test_id_or_classroom_id_from_callback(callback_data)
     test = await db_manager.get_test_by_id(test_id)
 
     if await check_test_or_classroom_was_deleted_and_inform_user(test, "Тест был удален", call):
@@ -608,8 +496,9 @@ async def handle_spec_current_test_query(call: types.CallbackQuery):
     )
 
 
-async def handle_change_test_status_query(call: types.CallbackQuery, new_status: TestStatus) -> None:
-    test_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_change_test_status_query(call: types.CallbackQuery,
+                                          callback_data: CallbackData, new_status: TestStatus) -> None:
+    test_id = get_test_id_or_classroom_id_from_callback(callback_data)
     updated_values = {'status_set_by_author': new_status}
     await db_manager.update_test_by_id(test_id, **updated_values)
     test = await db_manager.get_test_by_id(test_id)
@@ -626,8 +515,8 @@ async def handle_change_test_status_query(call: types.CallbackQuery, new_status:
     await call.bot.answer_callback_query(call.id, f"test {key_word}")
 
 
-async def handle_spec_current_classroom_query(call: types.CallbackQuery):
-    classroom_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_spec_current_classroom_query(call: types.CallbackQuery, callback_data: CallbackData):
+    classroom_id = get_test_id_or_classroom_id_from_callback(callback_data)
     classroom = await db_manager.get_classroom_by_id(classroom_id)
     if not classroom:
         await call.bot.edit_message_text("this classroom was deleted", call.from_user.id, call.message.message_id,
@@ -642,8 +531,10 @@ async def handle_spec_current_classroom_query(call: types.CallbackQuery):
                                      reply_markup=go_to_previous_menu_keyboard(CURRENT_CLASSROOMS))
 
 
-async def handle_current_classrooms_query(call: types.CallbackQuery) -> None:
-    current_classrooms = await db_manager.get_current_classrooms_by_user_id(call.from_user.id)
+async def handle_current_classrooms_query(call: types.CallbackQuery, callback_data: CallbackData) -> None:
+    direction, cursor = get_page_from_callback(callback_data)
+    current_classrooms = await db_manager.get_current_classrooms_by_user_id(
+        call.from_user.id, cursor=cursor, direction=direction)
     if len(current_classrooms) == 0:
         text = "Список групп пуст"
     else:
@@ -652,8 +543,8 @@ async def handle_current_classrooms_query(call: types.CallbackQuery) -> None:
                                      reply_markup=get_classrooms_keyboard(current_classrooms, 'current'))
 
 
-async def handle_delete_classroom_query(call: types.CallbackQuery) -> None:
-    classroom_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_delete_classroom_query(call: types.CallbackQuery, callback_data: CallbackData) -> None:
+    classroom_id = get_test_id_or_classroom_id_from_callback(callback_data)
     classroom = await db_manager.get_classroom_by_id(classroom_id)
     await call.bot.edit_message_text(
         f"Вы уверены, что хотите удалить группу \"{classroom.title}\"?",
@@ -666,8 +557,8 @@ async def delete_classroom(classroom_id: int):
     await db_manager.delete_classroom(classroom_id)
 
 
-async def handle_delete_test_query(call: types.CallbackQuery) -> None:
-    test_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_delete_test_query(call: types.CallbackQuery, callback_data: CallbackData) -> None:
+    test_id = get_test_id_or_classroom_id_from_callback(callback_data)
     test = await db_manager.get_test_by_id(test_id)
     await call.bot.edit_message_text(
         f"Вы уверены, что хотите удалить опрос \"{test.title}\"?",
@@ -680,21 +571,22 @@ async def delete_test(test_id: int):
     await db_manager.delete_test(test_id)
 
 
-async def handle_delete_entity_confirm_query(call: types.CallbackQuery) -> None:
-    entity, entity_id = call.data.split("#")[1:]
+async def handle_delete_entity_confirm_query(call: types.CallbackQuery, callback_data: CallbackData) -> None:
+    entity, entity_id = callback_data.parameters
     print('here,', entity, Entity.CLASSROOM.value, Entity.CLASSROOM.name, Entity.CLASSROOM)
     if entity == Entity.CLASSROOM.name:
-        await delete_classroom(int(entity_id))
+        await delete_classroom(entity_id)
     else:
-        await delete_test(int(entity_id))
+        await delete_test(entity_id)
     await call.bot.edit_message_text(f"{entity} успешно удален", call.from_user.id, call.message.message_id,
                                      reply_markup=get_go_to_main_menu_keyboard())
 
 
-async def handle_show_classroom_participants_query(call: types.CallbackQuery) -> None:
-    classroom_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_show_classroom_participants_query(call: types.CallbackQuery, callback_data: CallbackData) -> None:
+    classroom_id = get_test_id_or_classroom_id_from_callback(callback_data)
+    direction, cursor = get_page_from_callback(callback_data, parameters_before=1)
     classroom = await db_manager.get_classroom_by_id(classroom_id)
-    participants = await db_manager.get_users_in_classroom(classroom.id)
+    participants = await db_manager.get_users_in_classroom(classroom.id, cursor=cursor, direction=direction)
     if len(participants) == 0:
         msg = "Список участников пуст"
     else:
@@ -704,11 +596,11 @@ async def handle_show_classroom_participants_query(call: types.CallbackQuery) ->
         text=msg,
         chat_id=call.from_user.id,
         message_id=call.message.message_id,
-        reply_markup=go_to_previous_menu_keyboard(SPEC_CREATED_CLASSROOM, [classroom_id]))
+        reply_markup=get_classroom_participants_keyboard(classroom_id, participants))
 
 
-async def handle_spec_created_classroom_query(call: types.CallbackQuery):
-    classroom_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_spec_created_classroom_query(call: types.CallbackQuery, callback_data: CallbackData):
+    classroom_id = get_test_id_or_classroom_id_from_callback(callback_data)
     classroom = await db_manager.get_classroom_by_id(classroom_id)
     if not classroom:
         await call.bot.edit_message_text("Группа удалена", call.from_user.id, call.message.message_id,
@@ -720,26 +612,24 @@ async def handle_spec_created_classroom_query(call: types.CallbackQuery):
                                      reply_markup=get_spec_classroom_keyboard(classroom))
 
 
-async def handle_spec_share_test_link_to_classroom_query(call: types.CallbackQuery) -> None:
-    test_id, classroom_id = map(int, call.data.split("#")[1:])
-    await send_test_to_classroom_participants(test_id, classroom_id, call.bot)
-    await call.bot.edit_message_text("Сообщение отправлено участникам", call.from_user.id, call.message.message_id,
+async def handle_spec_share_test_link_to_classroom_query(call: types.CallbackQuery,
+                                                         callback_data: CallbackData) -> None:
+    test_id, classroom_id = callback_data.parameters
+    await send_test_to_classroom_participants(test_id, classroom_id, call.from_user.id, call.bot)
+    await call.bot.edit_message_text("Сообщение отправляется участникам, по завершении придёт отчёт",
+                                     call.from_user.id, call.message.message_id,
                                      reply_markup=get_go_to_main_menu_keyboard())
     # await call.bot.answer_callback_query(call.id)
 
 
-async def send_test_to_classroom_participants(test_id: int, classroom_id: int, bot: Bot) -> None:
-    participants = await db_manager.get_users_in_classroom(classroom_id)
-    for participant in participants:
-        await db_manager.add_user_to_test_participants(test_id, participant.id)
-        await bot.send_message(
-            participant.id,
-            text="Доступен новый опрос"
-        )
+async def send_test_to_classroom_participants(test_id: int, classroom_id: int, author_id: int, bot: Bot) -> None:
+    new_participant_ids = await db_manager.add_classroom_to_test_participants(test_id, classroom_id)
+    await broadcaster.start(bot, author_id, "Доступен новый опрос", new_participant_ids)
 
 
-async def handle_share_test_link_to_classroom_query(call: types.CallbackQuery) -> None:
-    classrooms = await db_manager.get_classrooms_by_author_id(call.from_user.id)
+async def handle_share_test_link_to_classroom_query(call: types.CallbackQuery, callback_data: CallbackData) -> None:
+    direction, cursor = get_page_from_callback(callback_data, parameters_before=1)
+    classrooms = await db_manager.get_classrooms_by_author_id(call.from_user.id, cursor=cursor, direction=direction)
     if len(classrooms) == 0:
         text = "Список групп пуст. Вы можете создать новую."
     else:
@@ -749,10 +639,12 @@ async def handle_share_test_link_to_classroom_query(call: types.CallbackQuery) -
     # await call.bot.answer_callback_query(call.id)
 
 
-async def handle_share_test_link_query(call: types.CallbackQuery) -> None:
-    test_id = get_test_id_or_classroom_id_from_callback(call.data)
+async def handle_share_test_link_query(call: types.CallbackQuery, callback_data: CallbackData) -> None:
+    test_id = get_test_id_or_classroom_id_from_callback(callback_data)
+    direction, cursor = get_page_from_callback(callback_data, parameters_before=1)
     test = await db_manager.get_test_by_id(test_id)
-    created_classrooms = await db_manager.get_classrooms_by_author_id(call.from_user.id)
+    created_classrooms = await db_manager.get_classrooms_by_author_id(
+        call.from_user.id, cursor=cursor, direction=direction)
     await call.bot.edit_message_text(
         f"Ссылка: {generate_link(Entity.TEST, test.uuid)}\nВыберите группу, чтобы отправить ссылку",
         call.from_user.id, call.message.message_id,
@@ -768,21 +660,26 @@ def generate_link(type_: Entity, uuid: int) -> str:
         return f"https://t.me/{bot_name}?start=class={uuid}"
 
 
-async def handle_current_ended_or_with_no_attempts_tests_query(call: types.CallbackQuery) -> None:
+async def handle_current_ended_or_with_no_attempts_tests_query(call: types.CallbackQuery,
+                                                               callback_data: CallbackData) -> None:
+    direction, cursor = get_page_from_callback(callback_data)
     current_ended_or_with_no_attempts_tests = await db_manager.get_current_ended_or_with_no_attempts_tests_by_user_id(
-        call.from_user.id)
+        call.from_user.id, cursor=cursor, direction=direction)
     if len(current_ended_or_with_no_attempts_tests) == 0:
         text = "У Вас нет завершенных опросов или автор их удалил"
     else:
         text = "Завершенные опросы"
     await call.bot.edit_message_text(text, call.from_user.id, call.message.message_id,
-                                     reply_markup=get_current_tests_keyboard(current_ended_or_with_no_attempts_tests))
+                                     reply_markup=get_current_tests_keyboard(current_ended_or_with_no_attempts_tests,
+                                                                            CURRENT_ENDED_OR_WITH_NO_ATTEMPTS_TESTS))
 
 
-async def handle_current_available_test_with_attempts_query(call: types.CallbackQuery) -> None:
+async def handle_current_available_test_with_attempts_query(call: types.CallbackQuery,
+                                                            callback_data: CallbackData) -> None:
+    direction, cursor = get_page_from_callback(callback_data)
     current_available_test_with_attempts = \
         await db_manager.get_current_available_test_with_attempts_by_user_id(
-            call.from_user.id
+            call.from_user.id, cursor=cursor, direction=direction
         )
     if len(current_available_test_with_attempts) == 0:
         text = "Список опросов пуст"
@@ -792,7 +689,8 @@ async def handle_current_available_test_with_attempts_query(call: types.Callback
         text=text,
         chat_id=call.from_user.id,
         message_id=call.message.message_id,
-        reply_markup=get_current_tests_keyboard(current_available_test_with_attempts)
+        reply_markup=get_current_tests_keyboard(current_available_test_with_attempts,
+                                                CURRENT_AVAILABLE_TEST_WITH_ATTEMPTS)
     )
 
 
@@ -817,16 +715,30 @@ def get_spec_test_info_message(test: Test) -> str:
     return msg
 
 
-def get_test_id_or_classroom_id_from_callback(callback: str) -> int:
-    return int(callback.split("#")[1])
+def get_test_id_or_classroom_id_from_callback(callback_data: CallbackData) -> int:
+    return callback_data[0]
+
+
+def get_page_from_callback(callback_data: CallbackData, parameters_before: int = 0) -> tuple[PageDirection, int | None]:
+    """
+    Page of a list requested by the callback of `get_page_navigation_buttons`.
+    :param parameters_before: Number of the callback parameters that go before the page ones.
+    :return: Direction and cursor of the page, the first page if the callback has no page parameters.
+    """
+    parameters = callback_data.parameters[parameters_before:]
+    if len(parameters) < 2:
+        return PageDirection.NEXT, None
+
+    return PageDirection(parameters[0]), parameters[1]
 
 
-async def handle_spec_created_test_query(call: types.CallbackQuery, state: FSMContext) -> None:
+async def handle_spec_created_test_query(call: types.CallbackQuery,
+                                         callback_data: CallbackData, state: FSMContext) -> None:
     """
     Shows menu with test settings: edit, refresh and so on
     """
     await state.clear()
-    test_id = get_test_id_or_classroom_id_from_callback(call.data)
+    test_id = get_test_id_or_classroom_id_from_callback(callback_data)
     test = await db_manager.get_test_by_id(test_id)
     await call.bot.edit_message_text(
         get_spec_test_info_message(test),
@@ -836,11 +748,11 @@ async def handle_spec_created_test_query(call: types.CallbackQuery, state: FSMCo
     )
 
 
-async def handle_edit_test_query(call: types.CallbackQuery, state: FSMContext) -> None:
+async def handle_edit_test_query(call: types.CallbackQuery, callback_data: CallbackData, state: FSMContext) -> None:
     """
     Shows menu with specific things to edit in test
     """
-    test_id = int(call.data.split("#")[1])
+    test_id = get_test_id_or_classroom_id_from_callback(callback_data)
     await state.clear()
     await call.bot.edit_message_text(
         "Что необходимо изменить?",
@@ -851,11 +763,12 @@ async def handle_edit_test_query(call: types.CallbackQuery, state: FSMContext) -
 
 async def handle_edit_test_something_query(
         call: types.CallbackQuery,
+        callback_data: CallbackData,
         state: FSMContext,
         next_state: State,
         text: str
 ):
-    test_id = int(call.data.split("#")[1])
+    test_id = get_test_id_or_classroom_id_from_callback(callback_data)
     await state.update_data(edit_test_id=test_id)
 
     await state.set_state(next_state)
@@ -867,34 +780,39 @@ async def handle_edit_test_something_query(
     )
 
 
-async def handle_edit_test_title_query(call: types.CallbackQuery, state: FSMContext):
+async def handle_edit_test_title_query(call: types.CallbackQuery, callback_data: CallbackData,
+                                       state: FSMContext):
     await handle_edit_test_something_query(
-        call, state, Form.edit_test_title, "Введите новое название"
+        call, callback_data, state, Form.edit_test_title, "Введите новое название"
     )
 
 
-async def handle_edit_test_time_query(call: types.CallbackQuery, state: FSMContext):
+async def handle_edit_test_time_query(call: types.CallbackQuery, callback_data: CallbackData,
+                                      state: FSMContext):
     await handle_edit_test_something_query(
-        call, state, Form.edit_test_time, "Введите новое время в минутах"
+        call, callback_data, state, Form.edit_test_time, "Введите новое время в минутах"
     )
 
 
-async def handle_edit_test_deadline_query(call: types.CallbackQuery, state: FSMContext):
+async def handle_edit_test_deadline_query(call: types.CallbackQuery, callback_data: CallbackData,
+                                          state: FSMContext):
     await handle_edit_test_something_query(
-        call, state, Form.edit_test_deadline, "Введите новый дедлайн"
+        call, callback_data, state, Form.edit_test_deadline, "Введите новый дедлайн"
     )
 
 
-async def handle_edit_test_attempts_number_query(call: types.CallbackQuery, state: FSMContext):
+async def handle_edit_test_attempts_number_query(call: types.CallbackQuery, callback_data: CallbackData,
+                                                 state: FSMContext):
     # todo check that number of attempts is not less than max number of attempts made by users already
     await handle_edit_test_something_query(
-        call, state, Form.edit_test_attempts_number, "Введите новое число попыток"
+        call, callback_data, state, Form.edit_test_attempts_number, "Введите новое число попыток"
     )
 
 
-async def handle_edit_test_link_query(call: types.CallbackQuery, state: FSMContext):
+async def handle_edit_test_link_query(call: types.CallbackQuery, callback_data: CallbackData,
+                                      state: FSMContext):
     await handle_edit_test_something_query(
-        call, state, Form.edit_test_link, "Введите новую ссылку"
+        call, callback_data, state, Form.edit_test_link, "Введите новую ссылку"
     )
 
 
@@ -966,6 +884,7 @@ async def type_edit_test(message: Message, state: FSMContext):
     await message.answer(
         "Загрузка...",
     )
+    await db_manager.commit()
     meta_data = await FormExtractor.extract_string(form_url=message.text.strip())
     if not meta_data and "second_form_attempt" not in data:
         await message.answer(
@@ -1022,6 +941,7 @@ async def type_create_test(message: Message, state: FSMContext):
     await message.answer(
         "Загрузка...",
     )
+    await db_manager.commit()
     meta_data = await FormExtractor.extract_string(form_url=message.text.strip())
     if not meta_data and "second_form_attempt" not in data:
         await message.answer(
@@ -1069,7 +989,8 @@ async def handle_save_test_query(call: types.CallbackQuery, state: FSMContext):
     if not tasks:
         return
 
-    new_test = await db_manager.add_test(
+    await db_manager.add_test_with_tasks(
+        tasks,
         title=title,
         author_id=call.from_user.id,
         link=data["test_link"],
@@ -1077,9 +998,6 @@ async def handle_save_test_query(call: types.CallbackQuery, state: FSMContext):
         responder_uri=responder_uri
     )
 
-    for task in tasks:
-        await db_manager.add_task(**task, test_id=new_test.id)
-
     tests = await db_manager.get_tests_by_author_id(call.from_user.id)
 
     await call.bot.edit_message_text(
@@ -1099,8 +1017,8 @@ async def handle_save_test_with_additionals_query(call: types.CallbackQuery, sta
     )
 
 
-async def handle_cancel_addition_query(call: types.CallbackQuery, state: FSMContext):
-    state_to_go = call.data.split("#")[1]
+async def handle_cancel_addition_query(call: types.CallbackQuery, callback_data: CallbackData, state: FSMContext):
+    state_to_go = callback_data[0]
     if state_to_go == "create_test_save_with_additions":
         await create_test_save_with_additions(call=call, state=state)
         return
@@ -1238,10 +1156,7 @@ async def create_test_save_with_additions(state: FSMContext, message: Message =
     if not tasks:
         return
 
-    new_test = await db_manager.add_test(**param_dict)
-
-    for task in tasks:
-        await db_manager.add_task(**task, test_id=new_test.id)
+    await db_manager.add_test_with_tasks(tasks, **param_dict)
 
     await state.clear()
 
@@ -1269,8 +1184,10 @@ async def handle_create_classroom_query(call: types.CallbackQuery, state: FSMCon
     await state.set_state(Form.create_classroom_title)
 
 
-async def handle_authors_classrooms_query(call: types.CallbackQuery) -> None:
-    authors_classrooms = await db_manager.get_classrooms_by_author_id(call.from_user.id)
+async def handle_authors_classrooms_query(call: types.CallbackQuery, callback_data: CallbackData) -> None:
+    direction, cursor = get_page_from_callback(callback_data)
+    authors_classrooms = await db_manager.get_classrooms_by_author_id(
+        call.from_user.id, cursor=cursor, direction=direction)
     if len(authors_classrooms) == 0:
         text = "Список групп пуст. Вы можете создать новую."
     else:
@@ -1279,9 +1196,10 @@ async def handle_authors_classrooms_query(call: types.CallbackQuery) -> None:
                                      reply_markup=get_classrooms_keyboard(authors_classrooms))
 
 
-async def handle_authors_tests_query(call: types.CallbackQuery, state: FSMContext) -> None:
+async def handle_authors_tests_query(call: types.CallbackQuery, callback_data: CallbackData, state: FSMContext) -> None:
     await state.clear()
-    authors_tests = await db_manager.get_tests_by_author_id(call.from_user.id)
+    direction, cursor = get_page_from_callback(callback_data)
+    authors_tests = await db_manager.get_tests_by_author_id(call.from_user.id, cursor=cursor, direction=direction)
     if len(authors_tests) == 0:
         text = "Список опросов пуст. Вы можете создать новый."
     else:
@@ -1294,6 +1212,67 @@ async def handle_authors_tests_query(call: types.CallbackQuery, state: FSMContex
         reply_markup=get_created_tests_keyboard(authors_tests)
     )
 
+
+callback_dispatcher = CallbackDispatcher()
+callback_dispatcher.register(BACK_TO_MAIN_MENU, handle_back_to_main_menu_query)
+
+# CREATED CLASSROOMS
+
+callback_dispatcher.register(AUTHORS_CLASSROOMS, handle_authors_classrooms_query)
+callback_dispatcher.register(CREATE_CLASSROOM, handle_create_classroom_query)
+callback_dispatcher.register(EDIT_CLASSROOM, handle_edit_classroom_query)
+callback_dispatcher.register(EDIT_CLASSROOM_TITLE, handle_edit_classroom_title_query)
+
+# CREATED TESTS
+
+callback_dispatcher.register(CREATE_TEST, handle_create_test_query)
+callback_dispatcher.register(SAVE_TEST, handle_save_test_query)
+callback_dispatcher.register(SAVE_TEST_WITH_ADDITIONALS, handle_save_test_with_additionals_query)
+callback_dispatcher.register(CANCEL_ADDITION, handle_cancel_addition_query)
+callback_dispatcher.register(EDIT_TEST, handle_edit_test_query)
+callback_dispatcher.register(EDIT_TEST_TITLE, handle_edit_test_title_query)
+callback_dispatcher.register(EDIT_TEST_TIME, handle_edit_test_time_query)
+callback_dispatcher.register(EDIT_TEST_DEADLINE, handle_edit_test_deadline_query)
+callback_dispatcher.register(EDIT_TEST_ATTEMPTS_NUMBER, handle_edit_test_attempts_number_query)
+callback_dispatcher.register(EDIT_TEST_LINK, handle_edit_test_link_query)
+callback_dispatcher.register(AUTHORS_TESTS, handle_authors_tests_query)
+callback_dispatcher.register(SPEC_CREATED_TEST, handle_spec_created_test_query)
+callback_dispatcher.register(SHARE_TEST_LINK, handle_share_test_link_query)
+callback_dispatcher.register(SHARE_TEST_LINK_TO_CLASSROOM, handle_share_test_link_to_classroom_query)
+callback_dispatcher.register(SPEC_SHARE_TEST_LINK_TO_CLASSROOM, handle_spec_share_test_link_to_classroom_query)
+callback_dispatcher.register(SPEC_CREATED_CLASSROOM, handle_spec_created_classroom_query)
+callback_dispatcher.register(SHOW_CLASSROOM_PARTICIPANTS, handle_show_classroom_participants_query)
+callback_dispatcher.register(DELETE_CLASSROOM, handle_delete_classroom_query)
+callback_dispatcher.register(DELETE_ENTITY_CONFIRM, handle_delete_entity_confirm_query)
+callback_dispatcher.register(CLOSE_TEST, partial(handle_change_test_status_query, new_status=TestStatus.UNAVAILABLE))
+callback_dispatcher.register(OPEN_TEST, partial(handle_change_test_status_query, new_status=TestStatus.AVAILABLE))
+callback_dispatcher.register(REFRESH_TEST_DATA, handle_refresh_test_data_query)
+callback_dispatcher.register(DELETE_TEST, handle_delete_test_query)
+
+# CURRENT TESTS
+
+callback_dispatcher.register(CURRENT_TESTS, handle_current_tests_query)
+callback_dispatcher.register(CURRENT_AVAILABLE_TEST_WITH_ATTEMPTS, handle_current_available_test_with_attempts_query)
+callback_dispatcher.register(CURRENT_ENDED_OR_WITH_NO_ATTEMPTS_TESTS,
+                             handle_current_ended_or_with_no_attempts_tests_query)
+callback_dispatcher.register(SPEC_CURRENT_TEST, handle_spec_current_test_query)
+callback_dispatcher.register(START_CURRENT_TEST, handle_start_current_test_query)
+callback_dispatcher.register(SPEC_CURRENT_TEST_TASK, handle_spec_current_test_task_query)
+callback_dispatcher.register(BACK_TO_TEST_QUESTIONS_FROM_TASK, handle_back_to_test_questions_from_task_query)
+callback_dispatcher.register(BACK_TO_QUESTION_TEXT, handle_back_to_question_text_query)
+callback_dispatcher.register(END_TEST, handle_end_test_query)
+
+# QUESTIONS
+
+callback_dispatcher.register(ONE_CHOICE_QUESTION_OPTION, handle_one_choice_question_option_query)
+callback_dispatcher.register(MULTIPLE_CHOICE_QUESTION_OPTION, handle_multiple_choice_question_option_query)
+
+# CURRENT CLASSROOMS
+
+callback_dispatcher.register(CURRENT_CLASSROOMS, handle_current_classrooms_query)
+callback_dispatcher.register(SPEC_CURRENT_CLASSROOM, handle_spec_current_classroom_query)
+
+
 # async def main() -> None:
 #     # with open(MAIN_LOG_FILE, "a") as log:
 #     #     if LOG_IN_FILE:
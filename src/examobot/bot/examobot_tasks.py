@@ -1,14 +1,19 @@
 from aiogram import Router, Bot
 from aiogram.types import Message, InlineKeyboardMarkup, CallbackQuery
 
+from examobot.bot.Button import CallbackData
+from examobot.bot.debounce import Debouncer
 from examobot.bot.keyboards import get_go_to_main_menu_keyboard, get_current_test_tasks_keyboard
+from examobot.bot.user_context import UserContext
 from examobot.db.manager import db_manager
 from examobot.db.tables import Task, Test
+from examobot.definitions import OPTIONS_KEYBOARD_REFRESH_DELAY
 from examobot.task_translator.question_type import QuestionType
 from examobot.task_translator.questions_classes import Question, OneChoiceQuestion, MultipleChoiceQuestion
 from examobot.task_translator.task_keyboards import get_no_options_keyboard, get_back_to_question_text
 
 tasks_router = Router(name="tasks_router")
+options_keyboard_debouncer = Debouncer(OPTIONS_KEYBOARD_REFRESH_DELAY)
 
 
 async def get_task_safe(
@@ -53,30 +58,28 @@ async def show_menu_with_tasks(cur_test_id: int, bot: Bot, chat_id: int, test_ti
     )
 
 
-async def get_current_user_test_task_state(user_id: int, bot: Bot, message_id: int):
-    user = await db_manager.get_user_by_id(user_id)
-    if not user:
-        return None, None, None
-
-    cur_test_id = user.current_test_id
-    cur_task_id = user.current_task_id
+async def get_current_user_test_task_state(user_context: UserContext, bot: Bot, message_id: int):
+    cur_test_id = user_context.current_test_id
+    cur_task_id = user_context.current_task_id
     if not cur_test_id or not cur_task_id:
-        await bot.delete_message(user_id, message_id)
-        return user, None, None
+        await bot.delete_message(user_context.id, message_id)
+        return None, None
 
-    return user, cur_test_id, cur_task_id
+    return cur_test_id, cur_task_id
 
 
 async def handle_question(
         question: Question,
         message_or_call: Message | CallbackQuery,
-        user_id: int,
+        user_context: UserContext,
         bot: Bot,
         answer_message_id: int,
         task: Task = None,
+        callback_data: CallbackData | None = None,
 ):
-    user, cur_test_id, cur_task_id = await get_current_user_test_task_state(
-        user_id=user_id,
+    user_id = user_context.id
+    cur_test_id, cur_task_id = await get_current_user_test_task_state(
+        user_context=user_context,
         bot=bot,
         message_id=answer_message_id
     )
@@ -95,11 +98,13 @@ async def handle_question(
         if not task:
             return
 
-    await question.save_answer(message_or_call, task.id)
+    await question.save_answer(message_or_call, task.id, callback_data)
 
     answer_is_saved_text = "Ответ сохранен"
     if isinstance(message_or_call, CallbackQuery):
         await bot.answer_callback_query(message_or_call.id, text=answer_is_saved_text)
+        # the options are marked after the answer is committed
+        db_manager.call_on_commit(lambda: schedule_options_keyboard_refresh(question, message_or_call, task))
 
     elif isinstance(message_or_call, Message):
         is_saved_message = await bot.send_message(
@@ -110,39 +115,62 @@ async def handle_question(
         # TODO Edit the message of question text by adding "Answer is saved"
 
         message_ids_to_delete = (
-                user.current_messages_to_delete +
+                user_context.current_messages_to_delete +
                 [
                     message_or_call.message_id,
                     is_saved_message.message_id
                 ]
         )
-        await db_manager.update_user_by_id(
-            user_id, current_messages_to_delete=message_ids_to_delete
-        )
+        user_context.update(current_messages_to_delete=message_ids_to_delete)
 
 
-async def handle_question_with_call(question: Question, call: CallbackQuery):
+def schedule_options_keyboard_refresh(question: Question, call: CallbackQuery, task: Task) -> None:
+    """
+    Marks the chosen options in the keyboard of the question once the user stops tapping them.
+    """
+    bot = call.bot
     user_id = call.from_user.id
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+
+    async def refresh() -> None:
+        answer = await db_manager.get_answer_by_task_id_and_user_id(task.id, user_id)
+        await bot.edit_message_reply_markup(
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=question.get_options_keyboard(task, answer)
+        )
+
+    options_keyboard_debouncer.schedule((chat_id, message_id), refresh)
+
+
+async def handle_question_with_call(
+        question: Question,
+        call: CallbackQuery,
+        callback_data: CallbackData,
+        user_context: UserContext
+):
     bot = call.bot
     message_id = call.message.message_id
 
     await handle_question(
         question=question,
         message_or_call=call,
-        user_id=user_id,
+        user_context=user_context,
         bot=bot,
-        answer_message_id=message_id
+        answer_message_id=message_id,
+        callback_data=callback_data
     )
 
 
 @tasks_router.message()
-async def handle_message_sent_by_user(message: Message):
+async def handle_message_sent_by_user(message: Message, user_context: UserContext):
     user_id = message.from_user.id
     bot = message.bot
     message_id = message.message_id
 
-    user, cur_test_id, cur_task_id = await get_current_user_test_task_state(
-        user_id=user_id,
+    cur_test_id, cur_task_id = await get_current_user_test_task_state(
+        user_context=user_context,
         bot=bot,
         message_id=message_id
     )
@@ -165,16 +193,18 @@ async def handle_message_sent_by_user(message: Message):
     await handle_question(
         question=question,
         message_or_call=message,
-        user_id=user_id,
+        user_context=user_context,
         bot=bot,
         answer_message_id=message_id,
         task=task
     )
 
 
-async def handle_one_choice_question_option_query(call: CallbackQuery):
-    await handle_question_with_call(OneChoiceQuestion(), call)
+async def handle_one_choice_question_option_query(call: CallbackQuery, callback_data: CallbackData,
+                                                  user_context: UserContext):
+    await handle_question_with_call(OneChoiceQuestion(), call, callback_data, user_context)
 
 
-async def handle_multiple_choice_question_option_query(call: CallbackQuery):
-    await handle_question_with_call(MultipleChoiceQuestion(), call)
+async def handle_multiple_choice_question_option_query(call: CallbackQuery, callback_data: CallbackData,
+                                                       user_context: UserContext):
+    await handle_question_with_call(MultipleChoiceQuestion(), call, callback_data, user_context)
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from examobot.bot.keyboards import get_back_to_main_menu_keyboard
+from examobot.db.manager import db_manager
+from examobot.db.tables import FormSubmission, FormSubmissionStatus
+from examobot.definitions import FORM_SUBMISSION_WORKERS, FORM_SUBMISSION_MAX_ATTEMPTS, FORM_SUBMISSION_RETRY_DELAY
+from examobot.form_handlers import FormAnswerSender
+from examobot.form_handlers.exceptions import BadRequestError, FormAnswerSenderException
+from examobot.task_translator.questions_classes import FormResponseParameters
+
+# how often the outbox is checked when nothing wakes the workers up, in seconds
+POLL_INTERVAL = 10
+# how long a taken submission is hidden from other workers, in seconds
+LEASE = 5 * 60
+MAX_RETRY_DELAY = 60 * 60
+
+SENT_TEXT = "Тест завершён, ответы отправлены"
+FAILED_TEXT = "unfortunately, some error occurred, the answers were not sent."
+
+
+class FormSubmitter:
+    """
+    Sends answers of finished tests to Google Forms in the background.
+
+    `submit` saves the answers to the `form_submissions` outbox in the unit of work of the update,
+    so finishing a test doesn't wait for Google, and the answers are kept until Google gets them.
+    `FORM_SUBMISSION_WORKERS` workers send due submissions, several processes may share the outbox.
+    Connection errors, timeouts and server errors are retried with exponentially growing delays;
+    a submission fails after `FORM_SUBMISSION_MAX_ATTEMPTS` attempts whatever went wrong, and right away
+    when the form rejects it with a client error status. The user is told when the answers are sent or finally fail.
+
+    A submission whose worker stopped after Google got it (e.g. a crash) is sent once more after `LEASE`.
+    """
+
+    def __init__(self) -> None:
+        self._workers: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    async def submit(
+            self, idempotency_key: str, user_id: int, test_id: int, answers: dict[int, FormResponseParameters]
+    ) -> bool:
+        """
+        :param idempotency_key: Identifies the finishing of the test, submissions with a key
+        that has already been submitted are ignored.
+        :return: Whether the submission was added.
+        """
+        added = await db_manager.add_form_submission(
+            idempotency_key=idempotency_key,
+            user_id=user_id,
+            test_id=test_id,
+            answers={str(question_id): params.values for question_id, params in answers.items()},
+            now=int(time.time()),
+        )
+        if added:
+            db_manager.call_on_commit(self._wakeup.set)
+        return added
+
+    async def start(self, bot: Bot) -> None:
+        if not self._workers:
+            self._workers = [
+                db_manager.create_background_task(self._work(bot)) for _ in range(FORM_SUBMISSION_WORKERS)
+            ]
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _work(self, bot: Bot) -> None:
+        while True:
+            try:
+                submission = await db_manager.claim_form_submission(now=int(time.time()), lease=LEASE)
+            except Exception:
+                logging.exception("Failed to take a form submission")
+                submission = None
+
+            if submission is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            try:
+                await self._process(bot, submission)
+            except Exception as e:
+                logging.exception(f"Failed to process form submission {submission.id}")
+                # otherwise taken again when the lease ends
+                if submission.attempts >= FORM_SUBMISSION_MAX_ATTEMPTS:
+                    await self._fail_safely(bot, submission, e)
+
+    async def _process(self, bot: Bot, submission: FormSubmission) -> None:
+        if submission.attempts > FORM_SUBMISSION_MAX_ATTEMPTS:
+            # the previous attempts were interrupted, e.g. their processes crashed
+            await self._fail(bot, submission, RuntimeError(f"interrupted {submission.attempts - 1} times"))
+            return
+
+        try:
+            await self._send(submission)
+        except BadRequestError as e:
+            if submission.attempts < FORM_SUBMISSION_MAX_ATTEMPTS:
+                delay = min(FORM_SUBMISSION_RETRY_DELAY * 2 ** (submission.attempts - 1), MAX_RETRY_DELAY)
+                logging.info(f"Form submission {submission.id} failed, retrying in {delay} s: {e}")
+                await db_manager.update_form_submission_by_id(
+                    submission.id, next_attempt_at=int(time.time()) + delay, last_error=str(e))
+                return
+
+            await self._fail(bot, submission, e)
+        except FormAnswerSenderException as e:
+            # the answers or the form are wrong or the form rejected them, sending them again won't help
+            await self._fail(bot, submission, e)
+        else:
+            await db_manager.update_form_submission_by_id(submission.id, status=FormSubmissionStatus.SENT)
+            await self._notify(bot, submission, SENT_TEXT)
+
+    @staticmethod
+    async def _send(submission: FormSubmission) -> None:
+        test = await db_manager.get_test_by_id(submission.test_id)
+        answers = {
+            int(question_id): FormResponseParameters.from_values(values)
+            for question_id, values in submission.answers.items()
+        }
+        await FormAnswerSender.send_answer_metadata(test.meta_data, answers)
+
+    async def _fail(self, bot: Bot, submission: FormSubmission, error: Exception) -> None:
+        logging.warning(f"Form submission {submission.id} failed after {submission.attempts} attempts: {error}")
+        await db_manager.update_form_submission_by_id(
+            submission.id, status=FormSubmissionStatus.FAILED, last_error=str(error))
+        await self._notify(bot, submission, FAILED_TEXT)
+
+    async def _fail_safely(self, bot: Bot, submission: FormSubmission, error: Exception) -> None:
+        try:
+            await self._fail(bot, submission, error)
+        except Exception:
+            logging.exception(f"Failed to mark form submission {submission.id} as failed")
+
+    @staticmethod
+    async def _notify(bot: Bot, submission: FormSubmission, text: str) -> None:
+        # a new message, the one that finished the test may show another menu by now
+        try:
+            await bot.send_message(submission.user_id, text=text, reply_markup=get_back_to_main_menu_keyboard())
+        except TelegramAPIError as e:
+            logging.info(f"Failed to notify user {submission.user_id} about form submission {submission.id}: "
+                         f"{e.message}")
+
+
+form_submitter = FormSubmitter()
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from functools import partial
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+from cachetools import TTLCache
+
+from examobot.db.manager import db_manager
+from examobot.definitions import FSM_STORAGE, FSM_TTL, FSM_CACHE_SIZE, FSM_CACHE_TTL
+
+# how often expired records are deleted, in seconds
+PURGE_INTERVAL = 60 * 60
+
+
+class DBStorage(BaseStorage):
+    """
+    FSM storage in the bot database, so states survive restarts and are shared by all bot processes.
+
+    A record expires `FSM_TTL` seconds after its last change, expired records are deleted
+    every `PURGE_INTERVAL` seconds in the background between `start` and `close`.
+    Records are read and written in the unit of work of the update, so a state set by a handler
+    that fails is rolled back with the rest of its changes.
+    With `FSM_CACHE_TTL` above 0 records are cached for that many seconds and the cache is updated
+    when a read or a write is committed. It is off by default: updates of a user may go to different processes,
+    whose caches would then be stale, so turn it on only when the updates of a user always
+    come to the same process.
+    """
+
+    def __init__(self, ttl: int = FSM_TTL, cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL) -> None:
+        self.ttl = ttl
+        # key -> (state, data)
+        self._cache: TTLCache[str, tuple[str | None, dict[str, Any]]] | None = \
+            TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_ttl > 0 else None
+        self._purge_task: asyncio.Task | None = None
+
+    @staticmethod
+    def _make_key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    async def _get_record(self, key: StorageKey) -> tuple[str | None, dict[str, Any]]:
+        db_key = self._make_key(key)
+        record = self._cache.get(db_key) if self._cache is not None else None
+        if record is None:
+            record = await db_manager.get_fsm_record(db_key, now=int(time.time())) or (None, {})
+            self._cache_on_commit(db_key, record)
+        return record
+
+    def _cache_on_commit(self, db_key: str, record: tuple[str | None, dict[str, Any]]) -> None:
+        if self._cache is not None:
+            # until then the record may be rolled back
+            self._cache.pop(db_key, None)
+            db_manager.call_on_commit(partial(self._cache.__setitem__, db_key, record))
+
+    async def _set(self, key: StorageKey, **values) -> None:
+        now = int(time.time())
+        db_key = self._make_key(key)
+        record = await db_manager.upsert_fsm_record(db_key, now=now, expires_at=now + self.ttl, **values)
+        self._cache_on_commit(db_key, record)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._set(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._get_record(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        await self._set(key, data=data.copy())
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._get_record(key)
+        # callers may change the dictionary, e.g. `update_data`
+        return data.copy()
+
+    async def _purge_periodically(self) -> None:
+        while True:
+            try:
+                await db_manager.delete_expired_fsm_records(int(time.time()))
+            except Exception:
+                logging.exception("Failed to delete expired FSM records")
+            await asyncio.sleep(PURGE_INTERVAL)
+
+    async def start(self) -> None:
+        if self._purge_task is None:
+            self._purge_task = db_manager.create_background_task(self._purge_periodically())
+
+    async def close(self) -> None:
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            await asyncio.gather(self._purge_task, return_exceptions=True)
+            self._purge_task = None
+        if self._cache is not None:
+            self._cache.clear()
+
+
+def create_fsm_storage() -> BaseStorage:
+    """
+    Storage chosen by `FSM_STORAGE`: "db" or "memory" (a single process, states are lost on restart).
+    """
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+
+    return DBStorage()
@@ -7,6 +7,8 @@ from examobot.bot.Button import Button
 GO_TO_MAIN_MENU_TEXT = 'Главное меню'
 GO_TO_PREVIOUS_MENU_TEXT = 'Назад'
 CANCEL_TEXT = 'Отмена'
+PREVIOUS_PAGE_TEXT = '⬅️'
+NEXT_PAGE_TEXT = '➡️'
 
 BACK_TO_MAIN_MENU = Button(name='BACK_TO_MAIN_MENU', text='Главное меню')
 
@@ -2,6 +2,7 @@ from aiogram import types
 
 from examobot.bot.entity import Entity
 from examobot.bot.keyboard_texts import *
+from examobot.db.pagination import Page, PageDirection
 from examobot.db.tables import *
 from examobot.task_translator.keyboard_task_texts import END_TEST
 
@@ -16,6 +17,24 @@ def get_button_to_prev_menu(button: Button, parameters: list[Any] | None = None,
     return button.get_button(parameters=parameters, new_text=new_text)
 
 
+def get_page_navigation_buttons(button: Button, page: Page, parameters: list[Any] | None = None):
+    """
+    Buttons that show the previous and the next pages of the list:
+    `button` is the one that opens the list, it receives `parameters` + [direction, cursor].
+    """
+    if parameters is None:
+        parameters = []
+
+    buttons = []
+    if page.has_prev:
+        buttons.append(button.get_button(
+            new_text=PREVIOUS_PAGE_TEXT, parameters=[*parameters, PageDirection.PREV.value, page.prev_cursor]))
+    if page.has_next:
+        buttons.append(button.get_button(
+            new_text=NEXT_PAGE_TEXT, parameters=[*parameters, PageDirection.NEXT.value, page.next_cursor]))
+    return buttons
+
+
 # AUTHOR'S KEYBOARDS #
 
 def get_authors_buttons_():
@@ -41,12 +60,14 @@ def get_delete_entity_confirm_keyboard(entity: Entity, entity_id: int):
 
 # CREATED CLASSROOMS
 
-def get_classrooms_keyboard(classrooms: list[Classroom], classroom_type: str = 'created'):
+def get_classrooms_keyboard(classrooms: Page[Classroom], classroom_type: str = 'created'):
     if classroom_type == 'created':
         btn = SPEC_CREATED_CLASSROOM
+        list_btn = AUTHORS_CLASSROOMS
         create_classroom_btn = [CREATE_CLASSROOM.get_button()]
     elif classroom_type == 'current':
         btn = SPEC_CURRENT_CLASSROOM
+        list_btn = CURRENT_CLASSROOMS
         create_classroom_btn = []
     else:
         raise ValueError(f'Unknown classroom type: {classroom_type}, expected "created" or "current"')
@@ -58,12 +79,21 @@ def get_classrooms_keyboard(classrooms: list[Classroom], classroom_type: str = '
 
     inline_keyboard = [
         *classrooms_list,
+        get_page_navigation_buttons(list_btn, classrooms),
         create_classroom_btn,
         [BACK_TO_MAIN_MENU_BUTTON],
     ]
     return types.InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
 
 
+def get_classroom_participants_keyboard(classroom_id: int, participants: Page[User]):
+    inline_keyboard = [
+        get_page_navigation_buttons(SHOW_CLASSROOM_PARTICIPANTS, participants, [classroom_id]),
+        [get_button_to_prev_menu(button=SPEC_CREATED_CLASSROOM, parameters=[classroom_id])],
+    ]
+    return types.InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
+
+
 def get_spec_classroom_keyboard(classroom: Classroom):
     inline_keyboard = [
         [SHOW_CLASSROOM_PARTICIPANTS.get_button(parameters=[classroom.id])],
@@ -89,7 +119,7 @@ def get_emoji_test_status(status: TestStatus):
         return '🔴'
 
 
-def get_created_tests_keyboard(tests: list[Test]):
+def get_created_tests_keyboard(tests: Page[Test]):
     tests_list = [
         [
             SPEC_CREATED_TEST.get_button(
@@ -102,6 +132,7 @@ def get_created_tests_keyboard(tests: list[Test]):
 
     inline_keyboard = [
         *tests_list,
+        get_page_navigation_buttons(AUTHORS_TESTS, tests),
         [CREATE_TEST.get_button()],
         [BACK_TO_MAIN_MENU_BUTTON],
     ]
@@ -145,7 +176,7 @@ def get_share_test_link_keyboard(test_id: int):
     return types.InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
 
 
-def get_share_test_link_to_classroom_keyboard(test_id: int, classrooms: list[Classroom]):
+def get_share_test_link_to_classroom_keyboard(test_id: int, classrooms: Page[Classroom]):
     classrooms_list = [
         [SPEC_SHARE_TEST_LINK_TO_CLASSROOM.get_button(new_text=clm.title, parameters=[test_id, clm.id])]
         for clm in classrooms
@@ -153,6 +184,7 @@ def get_share_test_link_to_classroom_keyboard(test_id: int, classrooms: list[Cla
 
     inline_keyboard = [
         *classrooms_list,
+        get_page_navigation_buttons(SHARE_TEST_LINK, classrooms, [test_id]),
         [SPEC_CREATED_TEST.get_button(new_text=GO_TO_PREVIOUS_MENU_TEXT, parameters=[test_id])],
     ]
     return types.InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
@@ -169,13 +201,17 @@ def get_current_tests_menu_keyboard():
     return types.InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
 
 
-def get_current_tests_keyboard(tests: list[Test]):
+def get_current_tests_keyboard(tests: Page[Test], list_button: Button):
+    """
+    :param list_button: Button that opens this list of tests, it is used for switching pages.
+    """
     tests_list = [
-        [SPEC_CURRENT_TEST.get_button(new_text=t.title, parameters=[t.id]) for t in tests]
+        [SPEC_CURRENT_TEST.get_button(new_text=t.title, parameters=[t.id])] for t in tests
     ]
 
     inline_keyboard = [
         *tests_list,
+        get_page_navigation_buttons(list_button, tests),
         [CURRENT_TESTS.get_button(new_text=GO_TO_PREVIOUS_MENU_TEXT)],
     ]
     return types.InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
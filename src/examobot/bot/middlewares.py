@@ -0,0 +1,100 @@
+import asyncio
+from typing import Callable, Awaitable, Any
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from examobot.bot.navigation import navigation_store
+from examobot.bot.user_context import UserContext, get_user_name
+from examobot.db.manager import db_manager
+from examobot.definitions import MAX_CONCURRENT_UPDATES
+
+
+class UserOrderingMiddleware(BaseMiddleware):
+    """
+    Updates of different users are handled concurrently, at most `max_concurrent_updates` at once,
+    and updates of one user are handled one by one in the order they came,
+    so e.g. quick taps on answer options don't overwrite each other's changes.
+
+    Should be the first middleware of updates after aiogram's `UserContextMiddleware` (it sets
+    `event_from_user`), before the FSM one: the order of updates is kept by the queue of the user's lock,
+    they join it in the order the dispatcher received them, and the state of the user is read
+    only when the previous update has changed it.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES) -> None:
+        self._semaphore = asyncio.Semaphore(max_concurrent_updates)
+        # user id -> (lock, number of updates of the user that hold or wait for the lock)
+        self._user_locks: dict[int, tuple[asyncio.Lock, int]] = {}
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        if user is None:
+            async with self._semaphore:
+                return await handler(event, data)
+
+        lock, users_updates = self._user_locks.get(user.id, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._user_locks[user.id] = (lock, users_updates + 1)
+
+        try:
+            # the user's lock first, so waiting users don't take the places of those who can go
+            async with lock, self._semaphore:
+                return await handler(event, data)
+        finally:
+            lock, users_updates = self._user_locks[user.id]
+            if users_updates == 1:
+                del self._user_locks[user.id]
+            else:
+                self._user_locks[user.id] = (lock, users_updates - 1)
+
+
+class DBSessionMiddleware(BaseMiddleware):
+    """
+    Runs the whole update inside one unit of work: every `db_manager` call made while
+    handling the update shares one session and the changes are committed once at the end.
+    The session itself is available to handlers as `session`.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        async with db_manager.unit_of_work() as session:
+            data["session"] = session
+            return await handler(event, data)
+
+
+class CurrentUserMiddleware(BaseMiddleware):
+    """
+    Loads the user who sent the update (creates it on the first update) and their navigation state
+    and passes them to handlers as `user_context`. Changes made through it are saved when the handler returns.
+    Should go after `DBSessionMiddleware`.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        db_user, _ = await db_manager.get_or_create_user(user.id, user.username, name=get_user_name(user))
+        user_context = UserContext(db_user, await navigation_store.get(user.id))
+        data["user_context"] = user_context
+
+        result = await handler(event, data)
+        await user_context.flush()
+        return result
+
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+
+from examobot.db.manager import db_manager
+from examobot.definitions import NAVIGATION_STORAGE, NAVIGATION_SAVE_INTERVAL, NAVIGATION_IDLE_TTL, BOT_PROCESSES
+
+
+class NavigationState:
+    """
+    Where the user is while taking a test.
+
+    current_test_id - the test the user has started
+    current_task_id - the task the user has opened
+    current_messages_to_delete - messages of the task to delete when the user leaves it
+    """
+    FIELDS = ("current_test_id", "current_task_id", "current_messages_to_delete")
+
+    def __init__(
+            self,
+            current_test_id: int | None = None,
+            current_task_id: int | None = None,
+            current_messages_to_delete: list[int] | None = None
+    ) -> None:
+        self.current_test_id = current_test_id
+        self.current_task_id = current_task_id
+        self.current_messages_to_delete = current_messages_to_delete or []
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class NavigationBackend(ABC):
+    @abstractmethod
+    async def load(self, user_id: int) -> NavigationState | None:
+        pass
+
+    @abstractmethod
+    async def save(self, states: dict[int, dict]) -> None:
+        """
+        :param states: `NavigationState.to_dict` of users by their ids.
+        """
+        pass
+
+
+class DBNavigationBackend(NavigationBackend):
+    async def load(self, user_id: int) -> NavigationState | None:
+        navigation = await db_manager.get_user_navigation(user_id)
+        if navigation is None:
+            return None
+
+        return NavigationState(**{field: getattr(navigation, field) for field in NavigationState.FIELDS})
+
+    async def save(self, states: dict[int, dict]) -> None:
+        await db_manager.save_user_navigations(
+            [{"user_id": user_id, **state} for user_id, state in states.items()])
+
+
+class MemoryNavigationBackend(NavigationBackend):
+    """
+    Keeps the states in the memory of the process, for local runs.
+    """
+
+    def __init__(self) -> None:
+        self._saved: dict[int, dict] = {}
+
+    async def load(self, user_id: int) -> NavigationState | None:
+        state = self._saved.get(user_id)
+        return NavigationState(**state) if state is not None else None
+
+    async def save(self, states: dict[int, dict]) -> None:
+        self._saved.update(states)
+
+
+class NavigationStore:
+    """
+    Navigation states of users in memory. Changed states are saved to the backend
+    every `save_interval` seconds and on shutdown, all with one statement, so answering
+    doesn't write to the DB. States of users idle for `idle_ttl` seconds are dropped from memory.
+    A crash loses the changes of the last `save_interval` seconds.
+
+    When the store is `shared` by several bot processes, updates of one user may come to any of them,
+    so nothing is kept in memory: states are read from the backend on every update and written
+    in its unit of work.
+    """
+
+    def __init__(self, backend: NavigationBackend, save_interval: float, idle_ttl: float, shared: bool = False) -> None:
+        self.backend = backend
+        self.save_interval = save_interval
+        self.idle_ttl = idle_ttl
+        self.shared = shared
+        self._states: dict[int, NavigationState] = {}
+        self._last_access: dict[int, float] = {}
+        self._changed: set[int] = set()
+        self._save_task: asyncio.Task | None = None
+
+    async def get(self, user_id: int) -> NavigationState:
+        if self.shared:
+            return await self.backend.load(user_id) or NavigationState()
+
+        self._last_access[user_id] = time.monotonic()
+        state = self._states.get(user_id)
+        if state is None:
+            state = await self.backend.load(user_id) or NavigationState()
+            # another update of the user may have loaded it meanwhile
+            state = self._states.setdefault(user_id, state)
+        return state
+
+    async def update(self, user_id: int, state: NavigationState, **fields) -> None:
+        """
+        Changes `fields` of the user's `state` (got with `get`) once the current unit of work is committed.
+        """
+        if self.shared:
+            await self.backend.save({user_id: {**state.to_dict(), **fields}})
+        else:
+            # not before the changes of the update are in the DB
+            db_manager.call_on_commit(lambda: self.set(user_id, **fields))
+
+    def set(self, user_id: int, **fields) -> None:
+        state = self._states.setdefault(user_id, NavigationState())
+        for field, value in fields.items():
+            setattr(state, field, value)
+        self._last_access[user_id] = time.monotonic()
+        self._changed.add(user_id)
+
+    async def save(self) -> None:
+        changed, self._changed = self._changed, set()
+        states = {user_id: self._states[user_id].to_dict() for user_id in changed}
+        try:
+            await self.backend.save(states)
+        except BaseException:
+            # saved with the next ones
+            self._changed |= changed
+            raise
+
+    def _drop_idle(self) -> None:
+        expired_before = time.monotonic() - self.idle_ttl
+        for user_id, last_access in list(self._last_access.items()):
+            if last_access < expired_before and user_id not in self._changed:
+                del self._last_access[user_id]
+                self._states.pop(user_id, None)
+
+    async def _save_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save()
+            except Exception:
+                logging.exception("Failed to save navigation states")
+            self._drop_idle()
+
+    async def start(self) -> None:
+        if self._save_task is None and not self.shared:
+            self._save_task = db_manager.create_background_task(self._save_periodically())
+
+    async def close(self) -> None:
+        if self._save_task is not None:
+            self._save_task.cancel()
+            await asyncio.gather(self._save_task, return_exceptions=True)
+            self._save_task = None
+        await self.save()
+
+
+def create_navigation_store() -> NavigationStore:
+    """
+    Store with the backend chosen by `NAVIGATION_STORAGE`: "db" or "memory".
+    The store is shared when there are several `BOT_PROCESSES`, the memory backend can't be shared.
+    """
+    shared = BOT_PROCESSES > 1
+    if NAVIGATION_STORAGE == "memory":
+        if shared:
+            raise ValueError("NAVIGATION_STORAGE=memory can't be used by several BOT_PROCESSES")
+        backend = MemoryNavigationBackend()
+    else:
+        backend = DBNavigationBackend()
+    return NavigationStore(
+        backend, save_interval=NAVIGATION_SAVE_INTERVAL, idle_ttl=NAVIGATION_IDLE_TTL, shared=shared)
+
+
+navigation_store = create_navigation_store()
@@ -0,0 +1,62 @@
+from typing import Any
+
+from aiogram import types
+
+from examobot.bot.navigation import NavigationState, navigation_store
+from examobot.db.manager import db_manager
+from examobot.db.tables import User
+
+
+def get_user_name(user: types.User) -> str:
+    name = ""
+    if user.first_name:
+        name += user.first_name
+    if user.last_name:
+        name += f" {user.last_name}"
+    return name
+
+
+class UserContext:
+    """
+    The user who sent the update, loaded (or created) once per update by `CurrentUserMiddleware`,
+    and their navigation state.
+    Fields changed with `update` are saved after the update is handled: navigation fields
+    to `navigation_store`, the others with one UPDATE of the user.
+    """
+
+    def __init__(self, user: User, navigation: NavigationState) -> None:
+        self.user = user
+        self.navigation = navigation
+        self._changes: dict[str, Any] = {}
+
+    @property
+    def id(self) -> int:
+        return self.user.id
+
+    @property
+    def current_test_id(self) -> int | None:
+        return self._changes.get("current_test_id", self.navigation.current_test_id)
+
+    @property
+    def current_task_id(self) -> int | None:
+        return self._changes.get("current_task_id", self.navigation.current_task_id)
+
+    @property
+    def current_messages_to_delete(self) -> list[int]:
+        return self._changes.get("current_messages_to_delete", self.navigation.current_messages_to_delete)
+
+    def update(self, **kwargs) -> None:
+        self._changes.update(kwargs)
+
+    async def flush(self) -> None:
+        if not self._changes:
+            return
+
+        navigation_changes = {
+            field: self._changes.pop(field) for field in NavigationState.FIELDS if field in self._changes
+        }
+        if navigation_changes:
+            await navigation_store.update(self.user.id, self.navigation, **navigation_changes)
+        if self._changes:
+            await db_manager.update_user_by_id(self.user.id, **self._changes)
+            self._changes.clear()
@@ -0,0 +1,71 @@
+"""
+Webhook mode: Telegram pushes updates to an aiohttp server instead of the bot polling `getUpdates`,
+so updates are delivered and handled concurrently.
+
+For a local run leave `WEBHOOK_BASE_URL` empty (the webhook isn't set in Telegram then)
+and POST recorded updates to the server:
+    python -m examobot.bot.webhook examobot/bot/examples/start_update.json
+"""
+import asyncio
+import json
+import logging
+import sys
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web, ClientSession
+
+from examobot.definitions import WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_BASE_URL
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """
+    Serves updates until cancelled. Startup and shutdown handlers of `dp` run with the server.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        if WEBHOOK_BASE_URL:
+            await bot.set_webhook(
+                WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+        logging.info(f"Webhook server is listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def post_updates(updates: list[dict], url: str) -> None:
+    """
+    Sends recorded updates to the webhook server the way Telegram does, all at once.
+    """
+    headers = {SECRET_TOKEN_HEADER: WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    async with ClientSession(headers=headers) as session:
+        async def post(update: dict) -> None:
+            async with session.post(url, json=update) as response:
+                print(f"update {update.get('update_id')}: {response.status}")
+
+        await asyncio.gather(*(post(update) for update in updates))
+
+
+def main():
+    with open(sys.argv[1], 'r') as file:
+        updates = json.load(file)
+
+    if isinstance(updates, dict):
+        updates = [updates]
+
+    asyncio.run(post_updates(updates, f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}"))
+
+
+if __name__ == "__main__":
+    main()
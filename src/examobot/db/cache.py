@@ -0,0 +1,76 @@
+from typing import Any, Awaitable, Callable, Hashable
+
+from cachetools import TTLCache
+from sqlalchemy import inspect
+
+from examobot.definitions import BOT_PROCESSES
+
+_MISSING = object()
+
+
+def detached_copy(entity: Any) -> Any:
+    """
+    Copy of the column values of an ORM instance that belongs to no session, so it isn't
+    expired or detached when the session that loaded the instance is rolled back or closed.
+    Lists of instances are copied item by item.
+    """
+    if entity is None:
+        return None
+    if isinstance(entity, (list, tuple)):
+        return [detached_copy(item) for item in entity]
+
+    mapper = inspect(entity).mapper
+    return mapper.class_(**{attribute.key: getattr(entity, attribute.key) for attribute in mapper.column_attrs})
+
+
+class EntityCache:
+    """
+    In-process cache of DB rows: entries live at most `ttl` seconds and the least
+    recently used ones are evicted when there are more than `maxsize` of them.
+    `None` (row doesn't exist) is never cached.
+
+    Invalidation reaches only this process, so the cache is off (every get loads the row)
+    when `ttl` is 0 or several `processes` serve the bot.
+
+    Loaded ORM instances are cached and returned as `detached_copy`: instances attached to
+    the session of an update would be expired by its rollback while other updates read them.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, processes: int = BOT_PROCESSES) -> None:
+        self._cache: TTLCache | None = TTLCache(maxsize=maxsize, ttl=ttl) if ttl > 0 and processes == 1 else None
+        # changes on every invalidation, so a load that started before it isn't stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self._cache.get(key, _MISSING) if self._cache is not None else _MISSING
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        generation = self._generation
+        value = detached_copy(await loader())
+        if self._cache is not None and value is not None and generation == self._generation:
+            self._cache[key] = value
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        self._generation += 1
+        if self._cache is not None:
+            self._cache.pop(key, None)
+
+    def invalidate_if(self, predicate: Callable[[Any], bool]) -> None:
+        self._generation += 1
+        for key, value in list(self._cache.items() if self._cache is not None else ()):
+            if predicate(value):
+                self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        if self._cache is not None:
+            self._cache.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache) if self._cache is not None else 0}
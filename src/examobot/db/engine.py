@@ -0,0 +1,103 @@
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from examobot.definitions import DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, \
+    DB_POOL_PRE_PING, DB_QUERY_CACHE_SIZE, DB_STATEMENT_CACHE_SIZE
+
+
+class PoolMetrics:
+    """
+    Counters of the connection pool usage.
+
+    checked_out     - connections that are handed out to sessions right now
+    max_checked_out - the highest value of `checked_out` seen so far
+    checkouts       - total number of checkouts from the pool
+    connects        - total number of new DBAPI connections opened by the pool
+    wait_time       - total seconds spent waiting for a connection from the pool
+    max_wait_time   - the longest single wait for a connection
+    """
+
+    def __init__(self) -> None:
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.connects = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def on_connect(self, *_) -> None:
+        self.connects += 1
+
+    def on_checkout(self, *_) -> None:
+        self.checkouts += 1
+        self.checked_out += 1
+        self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def on_checkin(self, *_) -> None:
+        self.checked_out = max(self.checked_out - 1, 0)
+
+    def on_wait(self, seconds: float) -> None:
+        self.wait_time += seconds
+        self.max_wait_time = max(self.max_wait_time, seconds)
+
+    def snapshot(self) -> dict[str, float]:
+        avg_wait_time = self.wait_time / self.checkouts if self.checkouts else 0.0
+        return {
+            "checked_out": self.checked_out,
+            "max_checked_out": self.max_checked_out,
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+            "wait_time": self.wait_time,
+            "avg_wait_time": avg_wait_time,
+            "max_wait_time": self.max_wait_time,
+        }
+
+
+def _make_timed_pool_class(metrics: PoolMetrics) -> type[AsyncAdaptedQueuePool]:
+    """
+    Pool events only tell when a connection was handed out, so the time spent waiting
+    for it is measured around the pool's own `_do_get`. The class (and so the metrics)
+    survives `engine.dispose()`, because the pool is recreated from `self.__class__`.
+    """
+
+    class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                metrics.on_wait(time.perf_counter() - started)
+
+    return TimedAsyncAdaptedQueuePool
+
+
+def create_engine(database_uri: str, metrics: PoolMetrics) -> AsyncEngine:
+    """
+    Creates the engine that should live as long as the process does.
+    Pool and cache sizes are taken from `examobot.definitions`.
+    """
+    connect_args = {}
+    if make_url(database_uri).get_driver_name() == "asyncpg":
+        connect_args["prepared_statement_cache_size"] = DB_STATEMENT_CACHE_SIZE
+
+    engine = create_async_engine(
+        database_uri,
+        echo=DB_ECHO,
+        poolclass=_make_timed_pool_class(metrics),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        query_cache_size=DB_QUERY_CACHE_SIZE,
+        connect_args=connect_args,
+    )
+
+    event.listen(engine.sync_engine, "connect", metrics.on_connect)
+    event.listen(engine.sync_engine, "checkout", metrics.on_checkout)
+    event.listen(engine.sync_engine, "checkin", metrics.on_checkin)
+    return engine
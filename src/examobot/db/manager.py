@@ -1,94 +1,310 @@
 import asyncio
+import contextvars
+import logging
 import uuid
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Any, Callable, Coroutine
 
-from sqlalchemy import select, and_, or_, update
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
+from sqlalchemy import select, and_, or_, update, insert, delete, case, func, ARRAY, String, Row, literal, any_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncEngine, AsyncSession
 
-from examobot.db.tables import Test, Task, User, Classroom, Base, UserClassroomParticipation, \
-    UserTestParticipation, UserTestParticipationStatus, TestStatus, Answer
-from examobot.definitions import DATABASE_URI
+from examobot.db.cache import EntityCache
+from examobot.db.engine import PoolMetrics, create_engine
+from examobot.db.migrations import migrate
+from examobot.db.pagination import Page, PageDirection, paginate
+from examobot.db.tables import Test, Task, User, Classroom, UserClassroomParticipation, \
+    UserTestParticipation, UserTestParticipationStatus, TestStatus, Answer, AnswerStatus, Broadcast, \
+    BroadcastStatus, FSMRecord, UserNavigation, FormSubmission, FormSubmissionStatus
+from examobot.definitions import DATABASE_URI, DB_ENTITY_CACHE_SIZE, DB_ENTITY_CACHE_TTL, LIST_PAGE_SIZE
 
+# session of the unit of work that is running in the current context (e.g. for the current update)
+_current_session: ContextVar[AsyncSession | None] = ContextVar("current_session", default=None)
 
-class EngineManager:
-    def __init__(self, path: str) -> None:
-        self.path = path
+# keys of `AsyncSession.info` with callbacks to run when the transaction of the session ends
+_ON_TRANSACTION_END = "on_transaction_end"
+_ON_COMMIT = "on_commit"
 
-    async def __aenter__(self) -> AsyncEngine:
-        self.engine = create_async_engine(self.path, echo=True)
-        return self.engine
-
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.engine.dispose()
+# strong references to running background tasks, otherwise they may be garbage collected
+_background_tasks: set[asyncio.Task] = set()
 
 
 class DBManager:
+    """
+    Nothing connects to the database on import: the engine is created on first use
+    and `init_` brings the schema up to date when the bot starts.
+    """
+
     def __init__(self):
-        self.session_maker = None
-        asyncio.run(self.init_())
+        self.pool_metrics = PoolMetrics()
+        self._engine: AsyncEngine | None = None
+        self._session_maker: async_sessionmaker[AsyncSession] | None = None
+
+        self.tests_cache = EntityCache(maxsize=DB_ENTITY_CACHE_SIZE, ttl=DB_ENTITY_CACHE_TTL)
+        self.tasks_cache = EntityCache(maxsize=DB_ENTITY_CACHE_SIZE, ttl=DB_ENTITY_CACHE_TTL)
+        self.test_tasks_cache = EntityCache(maxsize=DB_ENTITY_CACHE_SIZE, ttl=DB_ENTITY_CACHE_TTL)
+
+    @property
+    def engine(self) -> AsyncEngine:
+        if self._engine is None:
+            self._engine = create_engine(DATABASE_URI, self.pool_metrics)
+        return self._engine
+
+    @property
+    def session_maker(self) -> async_sessionmaker[AsyncSession]:
+        if self._session_maker is None:
+            self._session_maker = async_sessionmaker(self.engine, expire_on_commit=False)
+        return self._session_maker
 
     async def init_(self):
-        async with EngineManager(DATABASE_URI) as engine:
-            self.session_maker = async_sessionmaker(engine, expire_on_commit=False)
-            async with engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
+        async with self.engine.begin() as conn:
+            await migrate(conn)
+
+    async def close(self):
+        logging.info(f"DB pool: {self.engine.pool.status()}, metrics: {self.pool_metrics.snapshot()}")
+        logging.info(f"DB cache: tests {self.tests_cache.stats()}, tasks {self.tasks_cache.stats()}, "
+                     f"tasks of tests {self.test_tasks_cache.stats()}")
+        await self.engine.dispose()
+
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[AsyncSession]:
+        """
+        Opens a session that every DBManager call inside the block shares.
+        The session is committed once when the block ends and rolled back if it raises.
+        Nested units of work join the outer one.
+        Handlers that wait minutes for another service (e.g. loading a form from Google) call `commit`
+        before that, so the session doesn't hold a connection of the pool meanwhile.
+        """
+        session = _current_session.get()
+        if session is not None:
+            yield session
+            return
+
+        async with self.session_maker() as session:
+            token = _current_session.set(session)
+            try:
+                yield session
+                await session.commit()
+            except BaseException:
+                await session.rollback()
+                raise
+            finally:
+                _current_session.reset(token)
+                self._run_callbacks(session, _ON_TRANSACTION_END)
+
+            self._run_callbacks(session, _ON_COMMIT)
+
+    async def commit(self) -> None:
+        """
+        Commits the changes of the current unit of work made so far: its session gives the connection
+        back to the pool and takes one again on its next query. The update is no longer one transaction then,
+        so this is only for long calls to other services. Does nothing if there is no unit of work
+        or it has no transaction open.
+        """
+        session = _current_session.get()
+        if session is None or not session.in_transaction():
+            return
+
+        try:
+            await session.commit()
+        finally:
+            self._run_callbacks(session, _ON_TRANSACTION_END)
+        self._run_callbacks(session, _ON_COMMIT)
+
+    @staticmethod
+    def _run_callbacks(session: AsyncSession, key: str) -> None:
+        for callback in session.info.pop(key, []):
+            callback()
+
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Session of the current unit of work or, if there is none, a new one-off unit of work.
+        """
+        async with self.unit_of_work() as session:
+            yield session
+
+    @asynccontextmanager
+    async def _separate_session(self) -> AsyncIterator[AsyncSession]:
+        """
+        New session committed when the block ends, even inside a unit of work.
+        """
+        async with self.session_maker() as session, session.begin():
+            yield session
+
+    @staticmethod
+    def call_on_commit(callback: Callable[[], None]) -> None:
+        """
+        Calls `callback` after the current unit of work is committed (never, if it is rolled back),
+        or right away if there is no unit of work.
+        """
+        session = _current_session.get()
+        if session is None:
+            callback()
+            return
+
+        session.info.setdefault(_ON_COMMIT, []).append(callback)
+
+    @staticmethod
+    def create_background_task(coro: Coroutine) -> asyncio.Task:
+        """
+        Runs `coro` as a task outside the current unit of work:
+        DB calls of the task don't join the session of the update that started it.
+        """
+        context = contextvars.copy_context()
+        context.run(_current_session.set, None)
+        task = asyncio.create_task(coro, context=context)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return task
+
+    @staticmethod
+    def _invalidate_now_and_on_transaction_end(invalidate: Callable[[], None]) -> None:
+        """
+        Drops cached entries now and once more when the current transaction ends:
+        until then other updates still read the old rows and could put them back to the cache.
+        """
+        invalidate()
+        session = _current_session.get()
+        if session is not None:
+            session.info.setdefault(_ON_TRANSACTION_END, []).append(invalidate)
+
+    def _invalidate(self, cache: EntityCache, key: Any) -> None:
+        self._invalidate_now_and_on_transaction_end(lambda: cache.invalidate(key))
+
+    def _invalidate_tasks_of_test(self, test_id: int) -> None:
+        self._invalidate(self.test_tasks_cache, test_id)
+        self._invalidate_now_and_on_transaction_end(
+            lambda: self.tasks_cache.invalidate_if(lambda task: task.test_id == test_id))
 
     # USERS
 
     async def get_user_by_id(self, user_id: int) -> User:
         query = select(User).where(User.id == user_id)  # that's fine
-        async with self.session_maker() as session:
+        async with self._session() as session:
             result = await session.execute(query)
             user = result.scalars().first()
         return user
 
     async def add_user(self, user_id: int, username: str, name: str) -> User:
         new_user = User(id=user_id, username=username, name=name)
-        async with self.session_maker() as session:
+        async with self._session() as session:
             session.add(new_user)
-            await session.commit()
+            await session.flush()
         return new_user
 
+    async def get_or_create_user(self, user_id: int, username: str, name: str) -> tuple[User, bool]:
+        """
+        :return: The user and whether it has just been created.
+        """
+        async with self._session() as session:
+            user = (await session.scalars(select(User).where(User.id == user_id))).first()
+            if user is not None:
+                return user, False
+
+            # another update of the same user may have inserted it in the meantime
+            query = pg_insert(User).values(id=user_id, username=username, name=name) \
+                .on_conflict_do_nothing(index_elements=[User.id]) \
+                .returning(User)
+            user = (await session.scalars(query)).first()
+            if user is not None:
+                return user, True
+
+            user = (await session.scalars(select(User).where(User.id == user_id))).one()
+            return user, False
+
     async def check_if_user_exists(self, user_id: int) -> bool:
         query = select(User).where(User.id == user_id)  # that's fine
-        async with self.session_maker() as session:
+        async with self._session() as session:
             user = await session.execute(query)
             user = user.first()
         return bool(user)
 
+    # NAVIGATION
+
+    async def get_user_navigation(self, user_id: int) -> UserNavigation | None:
+        query = select(UserNavigation).where(UserNavigation.user_id == user_id)
+        async with self._session() as session:
+            navigation = await session.scalars(query)
+        return navigation.first()
+
+    async def save_user_navigations(self, navigations: list[dict[str, Any]]) -> None:
+        """
+        Inserts or replaces navigation states of several users with one statement.
+        :param navigations: Values of `UserNavigation` columns.
+        """
+        if not navigations:
+            return
+
+        table = UserNavigation.__table__
+        query = pg_insert(table)
+        query = query.on_conflict_do_update(
+            index_elements=[table.c.user_id],
+            set_={column.name: query.excluded[column.name] for column in table.c if column.name != "user_id"},
+        )
+        async with self._session() as session:
+            await session.execute(query, navigations)
+
     # CREATED CLASSROOMS AND TESTS
 
     async def get_test_by_id(self, test_id: int) -> Test:
-        query = select(Test).where(Test.id == test_id)
-        async with self.session_maker() as session:
-            result = await session.execute(query)
-            test = result.scalars().first()
-        return test
+        async def load() -> Test:
+            query = select(Test).where(Test.id == test_id)
+            async with self._session() as session:
+                result = await session.execute(query)
+                return result.scalars().first()
+
+        return await self.tests_cache.get_or_load(test_id, load)
 
     async def get_classroom_by_id(self, classroom_id: int) -> Classroom:
         query = select(Classroom).where(Classroom.id == classroom_id)
-        async with self.session_maker() as session:
+        async with self._session() as session:
             result = await session.execute(query)
             classroom = result.scalars().first()
         return classroom
 
-    async def get_tests_by_author_id(self, author_id: int) -> list[Test]:
+    async def get_tests_by_author_id(
+            self,
+            author_id: int,
+            cursor: int | None = None,
+            direction: PageDirection = PageDirection.NEXT,
+            page_size: int = LIST_PAGE_SIZE
+    ) -> Page[Test]:
         query = select(Test).where(Test.author_id == author_id)
-        async with self.session_maker() as session:
-            tests = await session.execute(query)
-
-        return tests.scalars().all()
+        async with self._session() as session:
+            return await paginate(session, query, Test.id, cursor, direction, page_size)
 
     async def add_test(self, **kwargs):
         uuid_ = str(uuid.uuid4())
         kwargs["uuid"] = uuid_
         new_test = Test(**kwargs)
-        async with self.session_maker() as session:
+        async with self._session() as session:
             session.add(new_test)
-            await session.commit()
+            await session.flush()
 
         test = await self.get_test_by_uuid(uuid_)
         return test
 
+    async def add_test_with_tasks(self, tasks: list[dict], **kwargs) -> Test:
+        """
+        Inserts the test and all of its tasks in one transaction:
+        the tasks go to the database as one multi-row INSERT.
+        :param tasks: Tasks in the format of `Translator.translate()` output.
+        :param kwargs: Fields of the test.
+        """
+        kwargs["uuid"] = str(uuid.uuid4())
+        async with self._session() as session:
+            result = await session.execute(insert(Test).values(**kwargs).returning(Test))
+            test = result.scalars().one()
+
+            if tasks:
+                # same set of keys in every row, otherwise the rows are split into several INSERTs
+                rows = [{"options": None, "is_other": False, **task, "test_id": test.id} for task in tasks]
+                await session.execute(insert(Task), rows)
+
+        return test
+
     async def add_classroom(self, author_id: int, title: str):
         new_classroom = Classroom(
             uuid=str(uuid.uuid4()),
@@ -96,61 +312,60 @@ class DBManager:
             author_id=author_id,
         )
 
-        async with self.session_maker() as session:
+        async with self._session() as session:
             session.add(new_classroom)
-            await session.commit()
+            await session.flush()
 
         return new_classroom
 
     async def delete_classroom(self, classroom_id: int):
-        classroom = await self.get_classroom_by_id(classroom_id)
-        query = select(UserClassroomParticipation).where(UserClassroomParticipation.classroom_id == classroom_id)
-        async with self.session_maker() as session:
-            res = await session.execute(query)
-            items = res.scalars().all()
-            for i in items:
-                await session.delete(i)
-
-            await session.delete(classroom)
-            await session.commit()
+        """
+        Participations and test connections of the classroom are removed by the database (ON DELETE CASCADE).
+        """
+        query = delete(Classroom).where(Classroom.id == classroom_id)
+        async with self._session() as session:
+            await session.execute(query)
 
     async def delete_test(self, test_id: int):
-        test = await self.get_test_by_id(test_id)
-        query = select(UserTestParticipation).where(UserTestParticipation.test_id == test_id)
-        async with self.session_maker() as session:
-            res = await session.execute(query)
-            items = res.scalars().all()
-            for i in items:
-                await session.delete(i)
-
-            await session.delete(test)
-            await session.commit()
+        """
+        Tasks, answers, participations and classroom connections of the test
+        are removed by the database (ON DELETE CASCADE).
+        """
+        query = delete(Test).where(Test.id == test_id)
+        async with self._session() as session:
+            await session.execute(query)
+            self._invalidate(self.tests_cache, test_id)
+            self._invalidate_tasks_of_test(test_id)
 
     async def get_classroom_by_uuid(self, classroom_uuid: str) -> Classroom:
         query = select(Classroom).where(Classroom.uuid == classroom_uuid)
-        async with self.session_maker() as session:
+        async with self._session() as session:
             result = await session.execute(query)
             classroom = result.scalars().first()
         return classroom
 
     async def get_test_by_uuid(self, test_uuid: str) -> Test:
         query = select(Test).where(Test.uuid == test_uuid)
-        async with self.session_maker() as session:
+        async with self._session() as session:
             result = await session.execute(query)
             test = result.scalars().first()
         return test
 
-    async def get_classrooms_by_author_id(self, author_id: int) -> list[Classroom]:
+    async def get_classrooms_by_author_id(
+            self,
+            author_id: int,
+            cursor: int | None = None,
+            direction: PageDirection = PageDirection.NEXT,
+            page_size: int = LIST_PAGE_SIZE
+    ) -> Page[Classroom]:
         query = select(Classroom).where(Classroom.author_id == author_id)
-        async with self.session_maker() as session:
-            classrooms = await session.execute(query)
-
-        return classrooms.scalars().all()
+        async with self._session() as session:
+            return await paginate(session, query, Classroom.id, cursor, direction, page_size)
 
     async def check_if_user_in_test(self, test_id: int, user_id: int) -> bool:
         query = select(UserTestParticipation).where(and_(UserTestParticipation.test_id == test_id,
                                                          UserTestParticipation.user_id == user_id))
-        async with self.session_maker() as session:
+        async with self._session() as session:
             result = await session.execute(query)
             test = result.scalars().first()
         return bool(test)
@@ -158,100 +373,139 @@ class DBManager:
     async def check_if_user_in_classroom(self, classroom_id: int, user_id: int) -> bool:
         query = select(UserClassroomParticipation).where(and_(UserClassroomParticipation.classroom_id == classroom_id,
                                                               UserClassroomParticipation.user_id == user_id))
-        async with self.session_maker() as session:
+        async with self._session() as session:
             result = await session.execute(query)
             classroom = result.scalars().first()
         return bool(classroom)
 
     async def add_user_to_test_participants(self, test_id: int, user_id: int):
-        async with self.session_maker() as session:
+        async with self._session() as session:
             new_user_test = UserTestParticipation(user_id=user_id, test_id=test_id)
             session.add(new_user_test)
-            await session.commit()
+            await session.flush()
+
+    async def add_classroom_to_test_participants(self, test_id: int, classroom_id: int) -> list[int]:
+        """
+        Enrolls all participants of the classroom to the test with one INSERT ... SELECT.
+        Users that already take part in the test are skipped.
+        :return: Ids of the newly enrolled users.
+        """
+        participation = UserTestParticipation.__table__
+        classroom_participants = select(
+            UserClassroomParticipation.user_id,
+            literal(test_id),
+        ).where(UserClassroomParticipation.classroom_id == classroom_id).distinct()
+
+        query = pg_insert(participation).from_select(["user_id", "test_id"], classroom_participants)
+        query = query.on_conflict_do_nothing(
+            constraint="uq_user_test_participation_user_id_test_id"
+        ).returning(participation.c.user_id)
+
+        async with self._session() as session:
+            result = await session.execute(query)
+            return result.scalars().all()
 
     async def add_user_to_classroom(self, classroom_id: int, user_id: int):
-        async with self.session_maker() as session:
+        async with self._session() as session:
             new_user_classroom = UserClassroomParticipation(user_id=user_id, classroom_id=classroom_id)
             session.add(new_user_classroom)
-            await session.commit()
-
-    async def get_users_in_classroom(self, classroom_id: int):
+            await session.flush()
+
+    async def get_users_in_classroom(
+            self,
+            classroom_id: int,
+            cursor: int | None = None,
+            direction: PageDirection = PageDirection.NEXT,
+            page_size: int = LIST_PAGE_SIZE
+    ) -> Page[User]:
         query = select(User).join(UserClassroomParticipation).where(
             UserClassroomParticipation.classroom_id == classroom_id)
-        async with self.session_maker() as session:
-            users = await session.execute(query)
-        return users.scalars().all()
+        async with self._session() as session:
+            return await paginate(session, query, User.id, cursor, direction, page_size)
 
     async def update_test_by_id(self, test_id: int, **kwargs):
         query = update(Test).values(**kwargs).where(Test.id == test_id)
-        async with self.session_maker() as session:
+        async with self._session() as session:
             await session.execute(query)
-            await session.commit()
+            self._invalidate(self.tests_cache, test_id)
 
     async def update_classroom_by_id(self, classroom_id: int, **kwargs):
         query = update(Classroom).values(**kwargs).where(Classroom.id == classroom_id)
-        async with self.session_maker() as session:
+        async with self._session() as session:
             await session.execute(query)
-            await session.commit()
 
     async def update_user_by_id(self, user_id: int, **kwargs):
         query = update(User).values(**kwargs).where(User.id == user_id)
-        async with self.session_maker() as session:
+        async with self._session() as session:
             await session.execute(query)
-            await session.commit()
-
-    async def update_answer_by_id(self, answer_id: int, **kwargs):
-        query = update(Answer).values(**kwargs).where(Answer.id == answer_id)
-        async with self.session_maker() as session:
-            await session.execute(query)
-            await session.commit()
 
     # CURRENT TESTS
 
-    async def get_current_ended_or_with_no_attempts_tests_by_user_id(self, user_id: int):
+    async def get_current_ended_or_with_no_attempts_tests_by_user_id(
+            self,
+            user_id: int,
+            cursor: int | None = None,
+            direction: PageDirection = PageDirection.NEXT,
+            page_size: int = LIST_PAGE_SIZE
+    ) -> Page[Test]:
         query = select(Test).join(UserTestParticipation).where(and_(UserTestParticipation.user_id == user_id,
                                                                     or_(Test.status_set_by_author == TestStatus.UNAVAILABLE,
                                                                         UserTestParticipation.status == UserTestParticipationStatus.PASSED_NO_ATTEMPTS)))
-        async with self.session_maker() as session:
-            tests = await session.execute(query)
-        return tests.scalars().all()
-
-    async def get_current_available_test_with_attempts_by_user_id(self, user_id: int):
+        async with self._session() as session:
+            return await paginate(session, query, Test.id, cursor, direction, page_size)
+
+    async def get_current_available_test_with_attempts_by_user_id(
+            self,
+            user_id: int,
+            cursor: int | None = None,
+            direction: PageDirection = PageDirection.NEXT,
+            page_size: int = LIST_PAGE_SIZE
+    ) -> Page[Test]:
         query = select(Test).join(UserTestParticipation).where(and_(UserTestParticipation.user_id == user_id,
                                                                     Test.status_set_by_author == TestStatus.AVAILABLE,
                                                                     UserTestParticipation.status != UserTestParticipationStatus.PASSED_NO_ATTEMPTS))
-        async with self.session_maker() as session:
-            tests = await session.execute(query)
-        return tests.scalars().all()
+        async with self._session() as session:
+            return await paginate(session, query, Test.id, cursor, direction, page_size)
 
     async def get_tasks_by_test_id(self, test_id: int):
-        query = select(Task).where(Task.test_id == test_id).order_by(Task.id)  # todo mb order
-        async with self.session_maker() as session:
-            tasks = await session.execute(query)
+        async def load() -> list[Task]:
+            query = select(Task).where(Task.test_id == test_id).order_by(Task.id)  # todo mb order
+            async with self._session() as session:
+                tasks = await session.execute(query)
+            return tasks.scalars().all()
 
-        return tasks.scalars().all()
+        return await self.test_tasks_cache.get_or_load(test_id, load)
 
     # TASKS
 
     async def get_task_by_id(self, task_id: int):
-        query = select(Task).where(Task.id == task_id)
-        async with self.session_maker() as session:
-            task = await session.execute(query)
-        return task.scalars().first()
-
-    async def get_current_classrooms_by_user_id(self, user_id: int):
+        async def load() -> Task:
+            query = select(Task).where(Task.id == task_id)
+            async with self._session() as session:
+                task = await session.execute(query)
+            return task.scalars().first()
+
+        return await self.tasks_cache.get_or_load(task_id, load)
+
+    async def get_current_classrooms_by_user_id(
+            self,
+            user_id: int,
+            cursor: int | None = None,
+            direction: PageDirection = PageDirection.NEXT,
+            page_size: int = LIST_PAGE_SIZE
+    ) -> Page[Classroom]:
         query = (
             select(Classroom).join(UserClassroomParticipation).where(
                 UserClassroomParticipation.user_id == user_id))  # that's fine
-        async with self.session_maker() as session:
-            classrooms = await session.execute(query)
-        return classrooms.scalars().all()
+        async with self._session() as session:
+            return await paginate(session, query, Classroom.id, cursor, direction, page_size)
 
     async def add_task(self, task: Task | None = None, **kwargs):
         new_task = task if task else Task(**kwargs)
-        async with self.session_maker() as session:
+        async with self._session() as session:
             session.add(new_task)
-            await session.commit()
+            await session.flush()
+            self._invalidate(self.test_tasks_cache, new_task.test_id)
 
         return new_task
 
@@ -265,7 +519,7 @@ class DBManager:
             )
         )
 
-        async with self.session_maker() as session:
+        async with self._session() as session:
             result = await session.execute(query)
             answer = result.scalars().first()
             return answer
@@ -278,23 +532,200 @@ class DBManager:
             )
         )
 
-        async with self.session_maker() as session:
+        async with self._session() as session:
             result = await session.execute(query)
             answer = result.scalars().all()
             return answer
 
+    async def get_answers_with_tasks_by_test_id_and_user_id(self, test_id: int, user_id: int) -> list[Row]:
+        """
+        Answers of the user to the test joined with their tasks in one query.
+        :return: Rows with `answer_data`, `task_type`, `google_form_question_id` and `options`.
+        """
+        query = select(
+            Answer.answer_data,
+            Task.task_type,
+            Task.google_form_question_id,
+            Task.options,
+        ).join(Task, Answer.task_id == Task.id).where(
+            and_(
+                Answer.user_id == user_id,
+                Task.test_id == test_id
+            )
+        )
+
+        async with self._session() as session:
+            result = await session.execute(query)
+            return result.all()
+
     async def delete_answers_by_test_id_and_user_id(self, test_id: int, user_id: int):
-        answers = await self.get_answers_by_test_id_and_user_id(test_id, user_id)
-        async with self.session_maker() as session:
-            for a in answers:
-                await session.delete(a)
+        query = delete(Answer).where(
+            and_(
+                Answer.user_id == user_id,
+                Answer.task_id.in_(select(Task.id).where(Task.test_id == test_id))
+            )
+        )
 
-            await session.commit()
+        async with self._session() as session:
+            await session.execute(query)
 
-    async def add_answer(self, answer: Answer):
-        async with self.session_maker() as session:
-            session.add(answer)
-            await session.commit()
+    async def upsert_answer(self, task_id: int, user_id: int, answer_data: list[str], status: AnswerStatus):
+        """
+        Saves the answer of the user in one INSERT ... ON CONFLICT DO UPDATE.
+        Every repeated answer increments `dispatch_number`.
+        """
+        query = pg_insert(Answer).values(task_id=task_id, user_id=user_id, answer_data=answer_data, status=status)
+        query = query.on_conflict_do_update(
+            constraint="uq_answers_user_id_task_id",
+            set_={
+                "answer_data": query.excluded.answer_data,
+                "status": query.excluded.status,
+                "dispatch_number": Answer.dispatch_number + 1,
+            }
+        )
+
+        async with self._session() as session:
+            await session.execute(query)
+
+    async def toggle_answer_option(self, task_id: int, user_id: int, option: str, status: AnswerStatus):
+        """
+        Adds `option` to the answer of the user or removes it if it is already chosen.
+        The toggle is done by the database in the same INSERT ... ON CONFLICT DO UPDATE statement.
+        """
+        async with self._session() as session:
+            await session.execute(self._toggle_answer_option_query(task_id, user_id, option, status))
+
+    @staticmethod
+    def _toggle_answer_option_query(task_id: int, user_id: int, option: str, status: AnswerStatus):
+        # the column has the generic ARRAY type, it has no `contains`
+        toggled_answer_data = case(
+            (literal(option) == any_(Answer.answer_data), func.array_remove(Answer.answer_data, option)),
+            else_=func.array_append(Answer.answer_data, option),
+        ).cast(ARRAY(String))
+
+        query = pg_insert(Answer).values(task_id=task_id, user_id=user_id, answer_data=[option], status=status)
+        return query.on_conflict_do_update(
+            constraint="uq_answers_user_id_task_id",
+            set_={
+                "answer_data": toggled_answer_data,
+                "status": query.excluded.status,
+                "dispatch_number": Answer.dispatch_number + 1,
+            }
+        )
+
+    # BROADCASTS
+
+    async def add_broadcast(self, author_id: int, text: str, recipient_ids: list[int], locked_until: int) -> Broadcast:
+        new_broadcast = Broadcast(author_id=author_id, text=text, recipient_ids=recipient_ids, locked_until=locked_until)
+        async with self._session() as session:
+            session.add(new_broadcast)
+            await session.flush()
+
+        return new_broadcast
+
+    async def claim_unfinished_broadcasts(self, now: int, lease: int) -> list[Broadcast]:
+        """
+        Takes unfinished broadcasts that no process is sending (their lease has ended)
+        and locks them for this one for `lease` seconds.
+        """
+        free = (
+            select(Broadcast.id)
+            .where(Broadcast.status == BroadcastStatus.IN_PROGRESS, Broadcast.locked_until <= now)
+            .with_for_update(skip_locked=True)
+        )
+        query = (
+            update(Broadcast)
+            .where(Broadcast.id.in_(free))
+            .values(locked_until=now + lease)
+            .returning(Broadcast)
+        )
+        async with self._session() as session:
+            broadcasts = (await session.execute(query)).scalars().all()
+        return sorted(broadcasts, key=lambda broadcast: broadcast.id)
+
+    async def update_broadcast_by_id(self, broadcast_id: int, **kwargs):
+        query = update(Broadcast).values(**kwargs).where(Broadcast.id == broadcast_id)
+        async with self._session() as session:
+            await session.execute(query)
+
+    # FORM SUBMISSIONS
+
+    async def add_form_submission(
+            self, idempotency_key: str, user_id: int, test_id: int,
+            answers: dict[str, list[dict[str, str]]], now: int
+    ) -> bool:
+        """
+        :return: Whether the submission was added, False if there is one with the same `idempotency_key`.
+        """
+        query = pg_insert(FormSubmission).values(
+            idempotency_key=idempotency_key, user_id=user_id, test_id=test_id,
+            answers=answers, status=FormSubmissionStatus.PENDING, attempts=0, next_attempt_at=now,
+        ).on_conflict_do_nothing(index_elements=[FormSubmission.idempotency_key]).returning(FormSubmission.id)
+        async with self._session() as session:
+            added_id = (await session.execute(query)).scalar()
+        return added_id is not None
+
+    async def claim_form_submission(self, now: int, lease: int) -> FormSubmission | None:
+        """
+        Takes the pending submission that is due first and postpones it by `lease` seconds,
+        so other workers (of this or other processes) don't take it while it is being sent.
+        :return: The submission with `attempts` counting the current one, None if nothing is due.
+        """
+        due = (
+            select(FormSubmission.id)
+            .where(FormSubmission.status == FormSubmissionStatus.PENDING, FormSubmission.next_attempt_at <= now)
+            .order_by(FormSubmission.next_attempt_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        query = (
+            update(FormSubmission)
+            .where(FormSubmission.id == due)
+            .values(attempts=FormSubmission.attempts + 1, next_attempt_at=now + lease)
+            .returning(FormSubmission)
+        )
+        async with self._separate_session() as session:
+            return (await session.execute(query)).scalar_one_or_none()
+
+    async def update_form_submission_by_id(self, submission_id: int, **kwargs):
+        query = update(FormSubmission).values(**kwargs).where(FormSubmission.id == submission_id)
+        async with self._separate_session() as session:
+            await session.execute(query)
+
+    # FSM STORAGE
+    # records are read and written in the unit of work of the update, so it holds one connection at most
+
+    async def get_fsm_record(self, key: str, now: int) -> tuple[str | None, dict] | None:
+        query = select(FSMRecord.state, FSMRecord.data).where(FSMRecord.key == key, FSMRecord.expires_at > now)
+        async with self._session() as session:
+            record = (await session.execute(query)).first()
+        return tuple(record) if record else None
+
+    async def upsert_fsm_record(self, key: str, now: int, expires_at: int, **values) -> tuple[str | None, dict]:
+        """
+        Sets `values` (state and/or data) of the record and prolongs it,
+        the other field is kept unless the record has expired.
+        :return: State and data of the record after the update.
+        """
+        query = pg_insert(FSMRecord).values(key=key, expires_at=expires_at, **{"state": None, "data": {}, **values})
+        kept_or_reset = {
+            name: case((FSMRecord.expires_at > now, getattr(FSMRecord, name)), else_=getattr(query.excluded, name))
+            for name in ("state", "data") if name not in values
+        }
+        query = query.on_conflict_do_update(
+            index_elements=[FSMRecord.key],
+            set_={**{name: getattr(query.excluded, name) for name in values}, **kept_or_reset,
+                  "expires_at": query.excluded.expires_at},
+        ).returning(FSMRecord.state, FSMRecord.data)
+
+        async with self._session() as session:
+            record = (await session.execute(query)).one()
+        return tuple(record)
+
+    async def delete_expired_fsm_records(self, now: int) -> None:
+        async with self._separate_session() as session:
+            await session.execute(delete(FSMRecord).where(FSMRecord.expires_at <= now))
 
 
 db_manager = DBManager()
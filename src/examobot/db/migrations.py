@@ -0,0 +1,207 @@
+"""
+Versioned schema migrations.
+
+The version of the schema is kept in the `schema_version` table. On startup `migrate`
+brings the database up to date:
+    - an empty database gets the current schema from the models and the latest version;
+    - a database created before the versioning appeared starts from version 0;
+    - then every migration with a version above the stored one is applied in order.
+
+To change the schema, change the models in `tables.py` and append a `Migration`
+with the next version number that does the same to existing databases.
+Migrations spell out their DDL instead of creating tables from the models:
+the models change later, a migration has to keep doing what it did at its version.
+"""
+import logging
+from typing import Callable
+
+from sqlalchemy import Table, MetaData, Column, Integer, Connection, select, insert, update, inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from examobot.db.tables import Base, User
+
+MigrationStep = str | Callable[[Connection], None]
+
+# any constant, it just has to be the same for every bot process
+MIGRATIONS_LOCK_ID = 8_211_420
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, nullable=False),
+)
+
+
+class Migration:
+    def __init__(self, version: int, description: str, *steps: MigrationStep) -> None:
+        """
+        :param version: Version of the schema after the migration.
+        :param description: What the migration does, for the logs.
+        :param steps: SQL statements or functions taking a synchronous connection.
+        """
+        self.version = version
+        self.description = description
+        self.steps = steps
+
+    def apply(self, conn: Connection) -> None:
+        for step in self.steps:
+            if isinstance(step, str):
+                conn.execute(text(step))
+            else:
+                step(conn)
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(
+        1, "ON DELETE CASCADE / SET NULL for references to tests, tasks and classrooms",
+        "ALTER TABLE tasks DROP CONSTRAINT IF EXISTS tasks_test_id_fkey, "
+        "ADD CONSTRAINT tasks_test_id_fkey FOREIGN KEY (test_id) REFERENCES tests (id) ON DELETE CASCADE",
+        "ALTER TABLE answers DROP CONSTRAINT IF EXISTS answers_task_id_fkey, "
+        "ADD CONSTRAINT answers_task_id_fkey FOREIGN KEY (task_id) REFERENCES tasks (id) ON DELETE CASCADE",
+        "ALTER TABLE user_test_participation DROP CONSTRAINT IF EXISTS user_test_participation_test_id_fkey, "
+        "ADD CONSTRAINT user_test_participation_test_id_fkey "
+        "FOREIGN KEY (test_id) REFERENCES tests (id) ON DELETE CASCADE",
+        "ALTER TABLE user_classroom_participation "
+        "DROP CONSTRAINT IF EXISTS user_classroom_participation_classroom_id_fkey, "
+        "ADD CONSTRAINT user_classroom_participation_classroom_id_fkey "
+        "FOREIGN KEY (classroom_id) REFERENCES classrooms (id) ON DELETE CASCADE",
+        "ALTER TABLE classroom_test_connection DROP CONSTRAINT IF EXISTS classroom_test_connection_test_id_fkey, "
+        "ADD CONSTRAINT classroom_test_connection_test_id_fkey "
+        "FOREIGN KEY (test_id) REFERENCES tests (id) ON DELETE CASCADE",
+        "ALTER TABLE classroom_test_connection DROP CONSTRAINT IF EXISTS classroom_test_connection_classroom_id_fkey, "
+        "ADD CONSTRAINT classroom_test_connection_classroom_id_fkey "
+        "FOREIGN KEY (classroom_id) REFERENCES classrooms (id) ON DELETE CASCADE",
+        "ALTER TABLE users DROP CONSTRAINT IF EXISTS users_current_test_id_fkey, "
+        "ADD CONSTRAINT users_current_test_id_fkey "
+        "FOREIGN KEY (current_test_id) REFERENCES tests (id) ON DELETE SET NULL",
+        "ALTER TABLE users DROP CONSTRAINT IF EXISTS users_current_task_id_fkey, "
+        "ADD CONSTRAINT users_current_task_id_fkey "
+        "FOREIGN KEY (current_task_id) REFERENCES tasks (id) ON DELETE SET NULL",
+    ),
+    Migration(
+        2, "one answer per user and task",
+        # the latest answer wins
+        "DELETE FROM answers a USING answers b "
+        "WHERE a.user_id = b.user_id AND a.task_id = b.task_id AND a.id < b.id",
+        "ALTER TABLE answers ADD CONSTRAINT uq_answers_user_id_task_id UNIQUE (user_id, task_id)",
+    ),
+    Migration(
+        3, "indexes for participation and task lookups",
+        "CREATE INDEX IF NOT EXISTS ix_user_test_participation_user_id_test_id "
+        "ON user_test_participation (user_id, test_id)",
+        "CREATE INDEX IF NOT EXISTS ix_user_classroom_participation_user_id_classroom_id "
+        "ON user_classroom_participation (user_id, classroom_id)",
+        "CREATE INDEX IF NOT EXISTS ix_tasks_test_id ON tasks (test_id)",
+    ),
+    Migration(
+        4, "one participation per user and test",
+        "DELETE FROM user_test_participation a USING user_test_participation b "
+        "WHERE a.user_id = b.user_id AND a.test_id = b.test_id AND a.id > b.id",
+        # the unique constraint has its own index on the same columns
+        "DROP INDEX IF EXISTS ix_user_test_participation_user_id_test_id",
+        "ALTER TABLE user_test_participation "
+        "ADD CONSTRAINT uq_user_test_participation_user_id_test_id UNIQUE (user_id, test_id)",
+    ),
+    Migration(
+        5, "broadcasts",
+        "DO $$ BEGIN CREATE TYPE broadcaststatus AS ENUM ('IN_PROGRESS', 'FINISHED'); "
+        "EXCEPTION WHEN duplicate_object THEN NULL; END $$",
+        "CREATE TABLE IF NOT EXISTS broadcasts ("
+        "id SERIAL NOT NULL, "
+        "author_id BIGINT NOT NULL, "
+        "text VARCHAR NOT NULL, "
+        "recipient_ids BIGINT[] NOT NULL, "
+        "processed_count INTEGER NOT NULL, "
+        "delivered_count INTEGER NOT NULL, "
+        "failed_count INTEGER NOT NULL, "
+        "status broadcaststatus NOT NULL, "
+        "locked_until BIGINT DEFAULT '0' NOT NULL, "
+        "PRIMARY KEY (id), "
+        "FOREIGN KEY (author_id) REFERENCES users (id))",
+        "CREATE INDEX IF NOT EXISTS ix_broadcasts_status ON broadcasts (status)",
+    ),
+    Migration(
+        6, "FSM storage",
+        "CREATE TABLE IF NOT EXISTS fsm_storage ("
+        "key VARCHAR NOT NULL, "
+        "state VARCHAR, "
+        "data JSON NOT NULL, "
+        "expires_at BIGINT NOT NULL, "
+        "PRIMARY KEY (key))",
+        "CREATE INDEX IF NOT EXISTS ix_fsm_storage_expires_at ON fsm_storage (expires_at)",
+    ),
+    Migration(
+        7, "navigation state of users in its own table, whether users have been welcomed",
+        "CREATE TABLE IF NOT EXISTS user_navigation ("
+        "user_id BIGINT NOT NULL, "
+        "current_test_id INTEGER, "
+        "current_task_id INTEGER, "
+        "current_messages_to_delete INTEGER[], "
+        "PRIMARY KEY (user_id))",
+        "INSERT INTO user_navigation (user_id, current_test_id, current_task_id, current_messages_to_delete) "
+        "SELECT id, current_test_id, current_task_id, current_messages_to_delete FROM users "
+        "WHERE current_test_id IS NOT NULL OR current_task_id IS NOT NULL OR current_messages_to_delete IS NOT NULL "
+        "ON CONFLICT DO NOTHING",
+        "ALTER TABLE users DROP COLUMN IF EXISTS current_test_id, DROP COLUMN IF EXISTS current_task_id, "
+        "DROP COLUMN IF EXISTS current_messages_to_delete",
+        # existing users can't be told apart from those who got the welcome text, they aren't welcomed again
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS greeted BOOLEAN NOT NULL DEFAULT TRUE",
+        "ALTER TABLE users ALTER COLUMN greeted SET DEFAULT FALSE",
+    ),
+    Migration(
+        8, "outbox of answers to send to Google Forms",
+        "DO $$ BEGIN CREATE TYPE formsubmissionstatus AS ENUM ('PENDING', 'SENT', 'FAILED'); "
+        "EXCEPTION WHEN duplicate_object THEN NULL; END $$",
+        "CREATE TABLE IF NOT EXISTS form_submissions ("
+        "id SERIAL NOT NULL, "
+        "idempotency_key VARCHAR NOT NULL, "
+        "user_id BIGINT NOT NULL, "
+        "test_id INTEGER NOT NULL, "
+        "answers JSON NOT NULL, "
+        "status formsubmissionstatus NOT NULL, "
+        "attempts INTEGER NOT NULL, "
+        "next_attempt_at BIGINT NOT NULL, "
+        "last_error VARCHAR, "
+        "PRIMARY KEY (id), "
+        "UNIQUE (idempotency_key), "
+        "FOREIGN KEY (user_id) REFERENCES users (id), "
+        "FOREIGN KEY (test_id) REFERENCES tests (id) ON DELETE CASCADE)",
+        "CREATE INDEX IF NOT EXISTS ix_form_submissions_status_next_attempt_at "
+        "ON form_submissions (status, next_attempt_at)",
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def _has_schema(conn: Connection) -> bool:
+    return inspect(conn).has_table(User.__tablename__)
+
+
+async def migrate(conn: AsyncConnection) -> None:
+    """
+    Applies pending migrations. Should be run inside a transaction:
+    if any migration fails, the schema stays as it was.
+    """
+    # several bot processes may start at the same time
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": MIGRATIONS_LOCK_ID})
+    await conn.run_sync(schema_version.create, checkfirst=True)
+
+    version = (await conn.execute(select(schema_version.c.version))).scalar()
+    if version is None:
+        if await conn.run_sync(_has_schema):
+            version = 0
+        else:
+            await conn.run_sync(Base.metadata.create_all)
+            version = LATEST_VERSION
+            logging.info(f"Created DB schema of version {version}")
+
+        await conn.execute(insert(schema_version).values(version=version))
+
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+
+        logging.info(f"Applying DB migration {migration.version}: {migration.description}")
+        await conn.run_sync(migration.apply)
+        await conn.execute(update(schema_version).values(version=migration.version))
@@ -0,0 +1,73 @@
+from enum import Enum
+from typing import Any, Generic, TypeVar
+
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+
+T = TypeVar("T")
+
+
+class PageDirection(Enum):
+    NEXT = "n"
+    PREV = "p"
+
+
+class Page(Generic[T]):
+    """
+    One page of a list ordered by a unique key (keyset pagination).
+    Cursors are keys of the first and the last item, they are used to fetch the neighbouring pages.
+    """
+
+    def __init__(self, items: list[T], has_prev: bool, has_next: bool, prev_cursor: Any, next_cursor: Any) -> None:
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+async def paginate(
+        session: AsyncSession,
+        query: Select,
+        key: InstrumentedAttribute,
+        cursor: Any | None,
+        direction: PageDirection,
+        page_size: int,
+) -> Page:
+    """
+    Fetches the page that goes after (`PageDirection.NEXT`) or before (`PageDirection.PREV`)
+    the item with key `cursor`, or the first page if `cursor` is None.
+    One extra row is fetched to know whether there is one more page in that direction.
+    """
+    if cursor is None:
+        direction = PageDirection.NEXT
+
+    if direction == PageDirection.NEXT:
+        if cursor is not None:
+            query = query.where(key > cursor)
+        query = query.order_by(key)
+    else:
+        query = query.where(key < cursor).order_by(key.desc())
+
+    result = await session.execute(query.limit(page_size + 1))
+    rows = result.scalars().all()
+    has_more = len(rows) > page_size
+    items = list(rows[:page_size])
+
+    if direction == PageDirection.NEXT:
+        has_prev, has_next = cursor is not None, has_more
+    else:
+        items.reverse()
+        has_prev, has_next = has_more, True
+
+    key_name = key.key
+    prev_cursor = getattr(items[0], key_name) if items else cursor
+    next_cursor = getattr(items[-1], key_name) if items else cursor
+    return Page(items, has_prev=has_prev, has_next=has_next, prev_cursor=prev_cursor, next_cursor=next_cursor)
@@ -1,7 +1,8 @@
 from enum import Enum
 from typing import List, Optional
 
-from sqlalchemy import ForeignKey, Column, LargeBinary, BigInteger, ARRAY, String, Integer
+from sqlalchemy import ForeignKey, Column, LargeBinary, BigInteger, ARRAY, String, Integer, UniqueConstraint, Index, \
+    JSON
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
@@ -38,6 +39,17 @@ class UserTestParticipationStatus(Enum):
     NOT_PASSED = 2
 
 
+class BroadcastStatus(Enum):
+    IN_PROGRESS = 0
+    FINISHED = 1
+
+
+class FormSubmissionStatus(Enum):
+    PENDING = 0
+    SENT = 1
+    FAILED = 2
+
+
 class AwaitStatusPrefix(Enum):
     CLASSROOM_NAME = "CMN:"
     TEST_NAME = "TTN:"
@@ -57,13 +69,11 @@ class User(Base):
     name: Mapped[str] = mapped_column(nullable=False)
     role: Mapped[Role] = mapped_column(nullable=False, default=Role.AUTHOR)
     await_status: Mapped[str] = mapped_column(nullable=True, default=None)
+    # whether the user has been sent the welcome text
+    greeted: Mapped[bool] = mapped_column(nullable=False, default=False)
 
     answers: Mapped[List["Answer"]] = relationship(back_populates="user", cascade="all,delete")  # Parent
 
-    current_test_id: Mapped[int] = mapped_column(ForeignKey("tests.id"), nullable=True, default=None)
-    current_task_id: Mapped[int] = mapped_column(ForeignKey("tasks.id"), nullable=True, default=None)
-    current_messages_to_delete: Column[ARRAY[int]] = Column(ARRAY(Integer), nullable=True, default=None)
-
     created_classrooms: Mapped[List["Classroom"]] = relationship(
         back_populates="author",  # todo maybe we need uselist=True here, maybe not, who knows
         cascade="all,delete")  # Parent
@@ -85,7 +95,7 @@ class Classroom(Base):
     author: Mapped[User] = relationship(back_populates="created_classrooms")  # Child
 
     classroom_test_connections: Mapped[List["ClassroomTestConnection"]] = (
-        relationship(back_populates="classroom", cascade="all,delete", uselist=True))  # Parent
+        relationship(back_populates="classroom", cascade="all,delete", passive_deletes=True, uselist=True))  # Parent
 
 
 class Test(Base):
@@ -107,17 +117,21 @@ class Test(Base):
     author_id: Mapped[BigInteger] = mapped_column(ForeignKey("users.id"), nullable=False)
     # author: Mapped[User] = relationship(back_populates="created_tests")  # Child
 
-    tasks: Mapped[List["Task"]] = relationship(back_populates="test", cascade="all,delete")  # Parent
+    tasks: Mapped[List["Task"]] = relationship(
+        back_populates="test", cascade="all,delete", passive_deletes=True)  # Parent
     classroom_test_connections: Mapped[List["ClassroomTestConnection"]] = (
-        relationship(back_populates="test", cascade="all,delete", uselist=True))  # Parent
+        relationship(back_populates="test", cascade="all,delete", passive_deletes=True, uselist=True))  # Parent
 
 
 class UserClassroomParticipation(Base):
     __tablename__ = 'user_classroom_participation'
+    __table_args__ = (
+        Index("ix_user_classroom_participation_user_id_classroom_id", "user_id", "classroom_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Column = Column(ForeignKey("users.id"), nullable=False)
-    classroom_id: Mapped[int] = mapped_column(ForeignKey("classrooms.id"), nullable=False, )
+    classroom_id: Mapped[int] = mapped_column(ForeignKey("classrooms.id", ondelete="CASCADE"), nullable=False)
 
 
 class Task(Base):
@@ -141,21 +155,25 @@ class Task(Base):
     task_type: Mapped[str] = mapped_column(nullable=False)
     # meta_data: Mapped[Optional[str]] = mapped_column(nullable=True, default=None)
 
-    answers: Mapped[List["Answer"]] = relationship(back_populates="task", cascade="all,delete")  # Parent
+    answers: Mapped[List["Answer"]] = relationship(
+        back_populates="task", cascade="all,delete", passive_deletes=True)  # Parent
 
-    test_id: Mapped[int] = mapped_column(ForeignKey("tests.id"), nullable=False)
+    test_id: Mapped[int] = mapped_column(ForeignKey("tests.id", ondelete="CASCADE"), nullable=False, index=True)
     test: Mapped[Test] = relationship(back_populates="tasks")  # Child
 
 
 class Answer(Base):
     __tablename__ = 'answers'
+    __table_args__ = (
+        UniqueConstraint("user_id", "task_id", name="uq_answers_user_id_task_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     answer_data: Column[ARRAY[str]] = Column(ARRAY(String), nullable=True, default=None)
     status: Mapped[AnswerStatus] = mapped_column(nullable=False, default=AnswerStatus.UNCHECKED)
     dispatch_number: Mapped[int] = mapped_column(nullable=False, default=1)
 
-    task_id: Mapped[int] = mapped_column(ForeignKey("tasks.id"))  # Child
+    task_id: Mapped[int] = mapped_column(ForeignKey("tasks.id", ondelete="CASCADE"))  # Child
     task: Mapped[Task] = relationship(back_populates="answers")
 
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))  # Child
@@ -164,10 +182,13 @@ class Answer(Base):
 
 class UserTestParticipation(Base):
     __tablename__ = 'user_test_participation'
+    __table_args__ = (
+        UniqueConstraint("user_id", "test_id", name="uq_user_test_participation_user_id_test_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Column = Column(ForeignKey("users.id"), nullable=False)
-    test_id: Mapped[int] = mapped_column(ForeignKey("tests.id"), nullable=False)
+    test_id: Mapped[int] = mapped_column(ForeignKey("tests.id", ondelete="CASCADE"), nullable=False)
     status: Mapped[UserTestParticipationStatus] = mapped_column(
         nullable=False, default=UserTestParticipationStatus.NOT_PASSED)
 
@@ -177,8 +198,86 @@ class ClassroomTestConnection(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
 
-    test_id: Mapped[int] = mapped_column(ForeignKey("tests.id"))  # Child
+    test_id: Mapped[int] = mapped_column(ForeignKey("tests.id", ondelete="CASCADE"))  # Child
     test: Mapped[Test] = relationship(back_populates="classroom_test_connections", uselist=False)
 
-    classroom_id: Mapped[int] = mapped_column(ForeignKey("classrooms.id"))  # Child
+    classroom_id: Mapped[int] = mapped_column(ForeignKey("classrooms.id", ondelete="CASCADE"))  # Child
     classroom: Mapped[Classroom] = relationship(back_populates="classroom_test_connections", uselist=False)
+
+
+class Broadcast(Base):
+    """
+    Message that is being sent to many users, the progress is saved so any process could resume the sending
+    when the lease of the one sending it ends.
+
+    processed_count - number of first `recipient_ids` that the message was sent to (or failed to)
+    locked_until - unix timestamp, until it the broadcast is sent by the process that took it
+    """
+    __tablename__ = 'broadcasts'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    author_id: Column = Column(ForeignKey("users.id"), nullable=False)
+    text: Mapped[str] = mapped_column(nullable=False)
+    recipient_ids: Column[ARRAY[int]] = Column(ARRAY(BigInteger), nullable=False)
+
+    processed_count: Mapped[int] = mapped_column(nullable=False, default=0)
+    delivered_count: Mapped[int] = mapped_column(nullable=False, default=0)
+    failed_count: Mapped[int] = mapped_column(nullable=False, default=0)
+    status: Mapped[BroadcastStatus] = mapped_column(nullable=False, default=BroadcastStatus.IN_PROGRESS, index=True)
+    locked_until: Column = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
+class FSMRecord(Base):
+    """
+    State and data of aiogram FSM, shared by all bot processes.
+
+    key - `StorageKey` of aiogram joined into a string
+    expires_at - unix timestamp, after it the record is treated as missing
+    """
+    __tablename__ = 'fsm_storage'
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    state: Mapped[Optional[str]] = mapped_column(nullable=True, default=None)
+    data: Column = Column(JSON, nullable=False, default=dict)
+    expires_at: Column = Column(BigInteger, nullable=False, index=True)
+
+
+class UserNavigation(Base):
+    """
+    Test and task the user has opened and messages to delete when the user leaves the task.
+    Kept in memory by `NavigationStore` and saved here from time to time, so it is not in `users`:
+    it changes on every answer. There are no foreign keys, a deleted test or task is handled as missing.
+    """
+    __tablename__ = 'user_navigation'
+
+    user_id: Column = Column(BigInteger, primary_key=True, autoincrement=False)
+    current_test_id: Mapped[Optional[int]] = mapped_column(nullable=True, default=None)
+    current_task_id: Mapped[Optional[int]] = mapped_column(nullable=True, default=None)
+    current_messages_to_delete: Column[ARRAY[int]] = Column(ARRAY(Integer), nullable=True, default=None)
+
+
+class FormSubmission(Base):
+    """
+    Answers of a finished test waiting to be sent to Google Forms (an outbox).
+    Saved in the same transaction that deletes the answers, sent by `FormSubmitter` in the background.
+
+    idempotency_key - identifies the finishing of the test, so finishing it twice saves one submission
+    answers - dictionary where keys are IDs of question items in dec format and values are
+        `FormResponseParameters.values`
+    next_attempt_at - unix timestamp, the submission is not sent before it
+    """
+    __tablename__ = 'form_submissions'
+    __table_args__ = (
+        Index("ix_form_submissions_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    idempotency_key: Mapped[str] = mapped_column(nullable=False, unique=True)
+    user_id: Column = Column(ForeignKey("users.id"), nullable=False)
+    test_id: Mapped[int] = mapped_column(ForeignKey("tests.id", ondelete="CASCADE"), nullable=False)
+    answers: Column = Column(JSON, nullable=False)
+
+    status: Mapped[FormSubmissionStatus] = mapped_column(nullable=False, default=FormSubmissionStatus.PENDING)
+    attempts: Mapped[int] = mapped_column(nullable=False, default=0)
+    next_attempt_at: Column = Column(BigInteger, nullable=False)
+    last_error: Mapped[Optional[str]] = mapped_column(nullable=True, default=None)
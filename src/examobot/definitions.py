@@ -17,10 +17,56 @@ MAIN_LOG_FILE = os.path.join(ROOT_DIR, "../../logs/log.txt")
 DB_DIR = os.path.join(ROOT_DIR, "../../data")
 DEFAULT_DB_FILE = os.path.join(DB_DIR, "examobot_db.db")
 DATABASE_URI = os.environ.get("DATABASE_URI")
+DB_ECHO = os.environ.get("DB_ECHO", "0") == "1"
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+DB_QUERY_CACHE_SIZE = int(os.environ.get("DB_QUERY_CACHE_SIZE", 500))  # compiled SQL cache of SQLAlchemy
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))  # prepared statements of asyncpg
+DB_ENTITY_CACHE_SIZE = int(os.environ.get("DB_ENTITY_CACHE_SIZE", 10_000))  # cached tests and tasks
+DB_ENTITY_CACHE_TTL = float(os.environ.get("DB_ENTITY_CACHE_TTL", 300))  # 0 turns the cache off
 
 # For bot
 TOKEN = os.environ.get("EXAM_O_BOT_TOKEN")
 BOT_NAME = os.environ.get('BOT_NAME')
+LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", 10))  # items on one page of lists in keyboards
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 25))  # messages per second to all chats
+BROADCAST_CHAT_RATE = float(os.environ.get("BROADCAST_CHAT_RATE", 1))  # messages per second to one chat
+BROADCAST_BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", 25))  # messages between saves of the progress
+FSM_STORAGE = os.environ.get("FSM_STORAGE", "db")  # "db" or "memory"
+FSM_TTL = int(os.environ.get("FSM_TTL", 7 * 24 * 60 * 60))  # seconds a state is kept after its last change
+FSM_CACHE_SIZE = int(os.environ.get("FSM_CACHE_SIZE", 10_000))
+# seconds states are cached for, 0 turns the cache off; only for a single process or routing of users to processes
+FSM_CACHE_TTL = float(os.environ.get("FSM_CACHE_TTL", 0))
+# bot processes serving the same bot (e.g. webhook workers), their per-process caches are off when above 1
+BOT_PROCESSES = int(os.environ.get("BOT_PROCESSES", 1))
+NAVIGATION_STORAGE = os.environ.get("NAVIGATION_STORAGE", "db")  # "db" or "memory"
+NAVIGATION_SAVE_INTERVAL = float(os.environ.get("NAVIGATION_SAVE_INTERVAL", 10))  # seconds between saves of changes
+NAVIGATION_IDLE_TTL = float(os.environ.get("NAVIGATION_IDLE_TTL", 60 * 60))  # seconds an idle user is kept in memory
+# seconds after the last tap on an answer option before its keyboard is updated
+OPTIONS_KEYBOARD_REFRESH_DELAY = float(os.environ.get("OPTIONS_KEYBOARD_REFRESH_DELAY", 0.7))
+# how many messages `UnchangedEditsMiddleware` remembers
+EDITED_MESSAGES_CACHE_SIZE = int(os.environ.get("EDITED_MESSAGES_CACHE_SIZE", 10000))
+# connections to Google Forms open at once and timeouts of answer submission, in seconds
+FORMS_HTTP_LIMIT_PER_HOST = int(os.environ.get("FORMS_HTTP_LIMIT_PER_HOST", 50))
+FORMS_HTTP_TIMEOUT = float(os.environ.get("FORMS_HTTP_TIMEOUT", 30))
+FORMS_HTTP_CONNECT_TIMEOUT = float(os.environ.get("FORMS_HTTP_CONNECT_TIMEOUT", 10))
+# workers sending answers of finished tests, attempts of one submission and the delay before the first retry
+FORM_SUBMISSION_WORKERS = int(os.environ.get("FORM_SUBMISSION_WORKERS", 10))
+FORM_SUBMISSION_MAX_ATTEMPTS = int(os.environ.get("FORM_SUBMISSION_MAX_ATTEMPTS", 8))
+FORM_SUBMISSION_RETRY_DELAY = int(os.environ.get("FORM_SUBMISSION_RETRY_DELAY", 5))
+# updates handled at once; not tied to the pool size: an update holds at most one connection (FSM records
+# are in its unit of work too) and gives it back while a form loads, so updates beyond the pool wait for
+# a connection in its queue and none of them waits for a second one
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES") or 100)
+BOT_MODE = os.environ.get("BOT_MODE", "polling")  # "polling" or "webhook"
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")  # address the webhook server listens on
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8080))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")  # checked in the X-Telegram-Bot-Api-Secret-Token header
+WEBHOOK_BASE_URL = os.environ.get("WEBHOOK_BASE_URL")  # public https address of the server, not set for local runs
 DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 6.1; rv:84.0) Gecko/20100101 Firefox/84.0"
 
 # For Google Script API
@@ -29,6 +75,10 @@ GOOGLE_CREDENTIALS_DIR = os.path.join(FORM_HANDLERS_DIR, "credentials")
 GOOGLE_CLIENT_SECRETS = os.path.join(GOOGLE_CREDENTIALS_DIR, "client_secrets.json")
 SCOPES = "https://www.googleapis.com/auth/forms.body.readonly"
 DISCOVERY_DOC = "https://forms.googleapis.com/$discovery/rest?version=v1"
+FORMS_API_VERSION = "v1"
+DISCOVERY_DOC_CACHE_PATH = os.path.join(GOOGLE_CREDENTIALS_DIR, "forms_discovery.json")
+DISCOVERY_DOC_CACHE_TTL = int(os.environ.get("DISCOVERY_DOC_CACHE_TTL", 24 * 60 * 60))
+GOOGLE_HTTP_POOL_SIZE = int(os.environ.get("GOOGLE_HTTP_POOL_SIZE", 4))  # idle authorized clients kept
 TOKEN_STORE_PATH = os.path.join(GOOGLE_CREDENTIALS_DIR, "token.json")
 TOKEN_STORE = file.Storage(TOKEN_STORE_PATH)
 
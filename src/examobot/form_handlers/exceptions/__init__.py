@@ -1,2 +1,3 @@
 from .form_answer_sender_exceptions import (FormAnswerSenderException, BadRequestError, JSONParseError,
-                                            URLFailedCreationError, HTMLParseError, TestCompleteFailError)
+                                            URLFailedCreationError, HTMLParseError, TestCompleteFailError,
+                                            RejectedRequestError)
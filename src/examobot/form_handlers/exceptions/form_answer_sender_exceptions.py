@@ -44,6 +44,20 @@ class TestCompleteFailError(FormAnswerSenderException):
         return f'Sending answers was failed. Please check that you wrote everything correctly according to form.'
 
 
+class RejectedRequestError(TestCompleteFailError):
+    """
+    The form answered with a client error status: sending the same answers again won't help.
+    """
+
+    def __init__(self, url: str, status: int):
+        self.url = url
+        self.status = status
+
+    def __str__(self):
+        return (f"Form rejected answers sent via link with status {self.status}:\n"
+                f"{self.url}")
+
+
 class BadRequestError(TestCompleteFailError):
     def __init__(self, url: str):
         self.url = url
@@ -2,12 +2,20 @@ import asyncio
 import json
 from typing import Any
 
-import requests
-from lxml import html
+import aiohttp
+from yarl import URL
 
 from examobot.form_handlers.exceptions import *
+from examobot.form_handlers.http_session import forms_http_session
+from examobot.form_handlers.response_detector import SubmissionPageDetector, CHUNK_SIZE
 from examobot.task_translator.questions_classes import FormResponseParameters
 
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+# longer links are rejected by Google, so answers that don't fit are sent only with POST
+MAX_GET_URL_LENGTH = 8000
+# client error statuses after which the request may succeed later
+RETRYABLE_STATUSES = (408, 429)
+
 
 class FormAnswerSender:
     """
@@ -16,48 +24,35 @@ class FormAnswerSender:
     """
 
     @staticmethod
-    def _create_send_url(base_url: str, answers: dict[int, FormResponseParameters]) -> str:
+    def _create_submit_url(base_url: str) -> str:
         """
-        This function creates needed link that when accessing allows to fill the form.
         :param base_url: Responder URI link for viewing form.
-        :param answers: Dictionary where keys are IDs of question items in dec format and values are the answers.
-        :return: URL link that will fill the form if sending request to it.
+        :return: URL link to which answers are sent to fill the form.
         :raises URLFailedCreationError: error that indicates that there was a problem during creating needed link.
         """
         try:
             form_id = base_url.split("/")[-2]
-            new_url = f'https://docs.google.com/forms/d/e/{form_id}/formResponse?&submit=Submit?&'
-            for question_id, params in answers.items():
-                params_string = ""
-                for param in params.get_parameters():
-                    params_string += f'{param["prefix"]}.{question_id}={param["value"]}&'
-
-                new_url += params_string
-            return new_url
+            return f'https://docs.google.com/forms/d/e/{form_id}/formResponse'
         except Exception as e:
             raise URLFailedCreationError from e
 
     @staticmethod
-    def _determine_if_test_is_complete(html_str: str):
+    def _create_form_body(answers: dict[int, FormResponseParameters]) -> str:
         """
-        This function determines if the test was completed after sending request to the forms link.
-        :param html_str: String representation of html page after sending answer to Google Forms. It could be either
-        the page that is telling that form is complete or the page with marks on what was wrong with previous
-        answers.
-        :raises HTMLParseError: error that indicates that `html_str` is probably in the wrong format.
-        :raises TestCompleteFailError: error that indicates that `html_str` had forms inside thus sending answers
-        definitely failed.
+        This function creates `application/x-www-form-urlencoded` body that fills the form, in one pass.
+        :param answers: Dictionary where keys are IDs of question items in dec format and values are the answers.
+        Values of the answers are already encoded with `urllib.parse.quote_plus`.
+        :return: Body of the request, without the length limit of URLs.
+        :raises URLFailedCreationError: error that indicates that there was a problem during creating the body.
         """
         try:
-            # Parse the HTML string
-            tree = html.fromstring(html_str)
-
-            # Check if the page contains a form tag
-            form_tags = tree.xpath('//form')
+            return "&".join(
+                f'{param["prefix"]}.{question_id}={param["value"]}'
+                for question_id, params in answers.items()
+                for param in params.get_parameters()
+            )
         except Exception as e:
-            raise HTMLParseError(html_str) from e
-        if form_tags:
-            raise TestCompleteFailError()
+            raise URLFailedCreationError from e
 
     @staticmethod
     async def send_answer_metadata(metadata: str, answers: dict[int, str]):
@@ -79,29 +74,57 @@ class FormAnswerSender:
         await FormAnswerSender.send_answer_responder_uri(data["responderUri"], answers)
 
     @staticmethod
-    async def send_answer_responder_uri(responder_uri: str, answers: dict[int, str]):
+    async def send_answer_responder_uri(responder_uri: str, answers: dict[int, FormResponseParameters]):
         """
-        Sends given `answers` to the given `responder_uri`.
+        Sends given `answers` to the given `responder_uri` in the body of POST request.
+        If the form rejects it, the answers are sent in the link of GET request, when it is not too long.
         :param responder_uri: link for viewing form.
         :param answers: Dictionary where keys are IDs of question items in dec format and values are the answers.
         """
-        url = FormAnswerSender._create_send_url(responder_uri, answers)
+        url = FormAnswerSender._create_submit_url(responder_uri)
+        body = FormAnswerSender._create_form_body(answers)
         print("RESPONSE URL: " + url)
-        resp = requests.get(url)
-        FormAnswerSender._raise_for_status_custom_exception(resp, url)
-        FormAnswerSender._determine_if_test_is_complete(resp.text)
+        try:
+            is_complete = await FormAnswerSender._request("POST", url, body=body)
+        except (BadRequestError, RejectedRequestError) as e:
+            get_url = f"{url}?{body}"
+            if not isinstance(e.__cause__, aiohttp.ClientResponseError) or len(get_url) > MAX_GET_URL_LENGTH:
+                raise
+            is_complete = await FormAnswerSender._request("GET", get_url)
+        if not is_complete:
+            raise TestCompleteFailError()
 
     @staticmethod
-    def _raise_for_status_custom_exception(resp, url):
+    async def _request(method: str, url: str, body: str | None = None) -> bool:
         """
-        Raises :class:`BadRequestError`, if one occurred.
-        :param resp: Response after sending request to fill the form.
-        :param url: URL to which the request was sent.
+        Sends request to fill the form with the shared session, without blocking the event loop.
+        The page that comes back is read only until it is clear if the test was completed.
+        :param method: "POST" or "GET".
+        :param url: URL to which the request is sent. It is already encoded, so it is sent as is.
+        :param body: Encoded body of the form for POST request.
+        :return: Whether the test was completed: the page tells that the form is complete,
+        not marks on what was wrong with the answers.
+        :raises BadRequestError: error that indicates that the request failed, timed out or got a server error
+        status, so it may succeed later.
+        :raises RejectedRequestError: error that indicates that the request got a client error status.
+        :raises HTMLParseError: error that indicates that the page is empty.
         """
+        data, headers = (body.encode(), {"Content-Type": FORM_CONTENT_TYPE}) if body is not None else (None, None)
         try:
-            print(resp.status_code)
-            resp.raise_for_status()
-        except requests.HTTPError as e:
+            async with forms_http_session.get().request(
+                    method, URL(url, encoded=True), data=data, headers=headers) as resp:
+                print(resp.status)
+                resp.raise_for_status()
+                detector = SubmissionPageDetector()
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    if detector.feed(chunk) is not None:
+                        break
+                return await detector.finish()
+        except aiohttp.ClientResponseError as e:
+            if 400 <= e.status < 500 and e.status not in RETRYABLE_STATUSES:
+                raise RejectedRequestError(url, e.status) from e
+            raise BadRequestError(url) from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             raise BadRequestError(url) from e
 
     @staticmethod
@@ -117,6 +140,13 @@ class FormAnswerSender:
             raise JSONParseError(metadata) from e
 
 
+async def _send_and_close(form_answer_sender, data, answers):
+    try:
+        await form_answer_sender.send_answer_data(data, answers)
+    finally:
+        await forms_http_session.close()
+
+
 def _correct_send(form_answer_sender, data):
     correct_answers = {
         1868536814: FormResponseParameters("1965"),
@@ -125,7 +155,7 @@ def _correct_send(form_answer_sender, data):
         857106950: FormResponseParameters("%D0%92%D0%B0%D1%80%D0%B8%D0%B0%D0%BD%D1%82+1"),
         422932123: FormResponseParameters("%D0%92%D0%B0%D1%80%D0%B8%D0%B0%D0%BD%D1%82+1")
     }
-    asyncio.run(form_answer_sender.send_answer_data(data, correct_answers))
+    asyncio.run(_send_and_close(form_answer_sender, data, correct_answers))
 
 
 def _incorrect_send_fail(form_answer_sender, data):
@@ -137,7 +167,7 @@ def _incorrect_send_fail(form_answer_sender, data):
         422932123: FormResponseParameters("%D0%92%D0%B0%D1%80%D0%B8%D0%B0%D0%BD%D1%82+1")
     }
     try:
-        asyncio.run(form_answer_sender.send_answer_data(data, incorrect_answers))
+        asyncio.run(_send_and_close(form_answer_sender, data, incorrect_answers))
     except TestCompleteFailError as e:
         print(e)
         print("If this error was caught then we successfully sent answers but they were in a wrong format.")
@@ -152,7 +182,7 @@ def _radio_and_checkbox_send(form_answer_sender, data):
         1909443258: FormResponseParameters("%D0%90")
     }
     try:
-        asyncio.run(form_answer_sender.send_answer_data(data, answers))
+        asyncio.run(_send_and_close(form_answer_sender, data, answers))
     except TestCompleteFailError as e:
         print(e)
         print("If this error was caught then we successfully sent answers but they were in a wrong format.")
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable
+
+from googleapiclient import discovery
+from googleapiclient.http import HttpRequest
+from httplib2 import Http
+from oauth2client import client, tools
+
+from examobot.definitions import GOOGLE_CLIENT_SECRETS, TOKEN_STORE, SCOPES, DISCOVERY_DOC, FORMS_API_VERSION, \
+    DISCOVERY_DOC_CACHE_PATH, DISCOVERY_DOC_CACHE_TTL, GOOGLE_HTTP_POOL_SIZE
+
+
+class FormsService:
+    """
+    Google Forms API service shared by the whole process.
+
+    Credentials are loaded from `TOKEN_STORE` once and refreshed only when the access token expires.
+    The discovery document is kept in `DISCOVERY_DOC_CACHE_PATH` and downloaded again
+    when it is older than `DISCOVERY_DOC_CACHE_TTL` seconds; the cached one is kept if Google
+    is unavailable or returns a document of another version.
+    Requests are executed in threads, each with an authorized `Http` from a pool
+    of at most `GOOGLE_HTTP_POOL_SIZE` idle ones (`Http` can't be shared by threads).
+    """
+
+    def __init__(self, pool_size: int = GOOGLE_HTTP_POOL_SIZE) -> None:
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        # the discovery document is loaded and the service is built by one thread
+        self._service_lock = threading.Lock()
+        self._credentials: client.OAuth2Credentials | None = None
+        self._service: Any = None
+        # (credentials the client is authorized with, client)
+        self._idle_clients: queue.SimpleQueue[tuple[client.OAuth2Credentials, Http]] = queue.SimpleQueue()
+
+    def _get_credentials(self) -> client.OAuth2Credentials:
+        with self._lock:
+            try:
+                credentials = self._credentials
+                if credentials is None or credentials.invalid:
+                    credentials = TOKEN_STORE.get()
+                    if not credentials or credentials.invalid:
+                        flow = client.flow_from_clientsecrets(str(GOOGLE_CLIENT_SECRETS), SCOPES)
+                        credentials = tools.run_flow(flow, TOKEN_STORE)
+                    self._credentials = credentials
+
+                if credentials.access_token_expired:
+                    credentials.refresh(Http())
+                return credentials
+            except Exception as e:
+                e.add_note("Login failure")
+                raise
+
+    @staticmethod
+    def _read_cached_discovery_document() -> tuple[dict | None, float]:
+        """
+        :return: The cached document (None if there is no valid one) and when it was saved.
+        """
+        try:
+            with open(DISCOVERY_DOC_CACHE_PATH, "r") as file:
+                document = json.load(file)
+            saved_at = os.path.getmtime(DISCOVERY_DOC_CACHE_PATH)
+        except (OSError, ValueError):
+            return None, 0
+
+        if document.get("version") != FORMS_API_VERSION:
+            return None, 0
+        return document, saved_at
+
+    @staticmethod
+    def _load_discovery_document() -> dict:
+        cached, saved_at = FormsService._read_cached_discovery_document()
+        if cached is not None and time.time() - saved_at < DISCOVERY_DOC_CACHE_TTL:
+            return cached
+
+        try:
+            response, content = Http().request(DISCOVERY_DOC)
+            if response.status != 200:
+                raise ValueError(f"status {response.status}")
+            document = json.loads(content)
+            if document.get("version") != FORMS_API_VERSION:
+                raise ValueError(f"version {document.get('version')}")
+        except Exception as e:
+            if cached is None:
+                raise
+            logging.warning(f"Failed to download the Google Forms discovery document, the cached one is used: {e}")
+            return cached
+
+        if cached is not None and cached.get("revision") == document.get("revision"):
+            os.utime(DISCOVERY_DOC_CACHE_PATH)
+        else:
+            # written whole or not at all, other processes may read it meanwhile
+            temp_path = f"{DISCOVERY_DOC_CACHE_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w") as file:
+                json.dump(document, file)
+            os.replace(temp_path, DISCOVERY_DOC_CACHE_PATH)
+        return document
+
+    def _get_service(self) -> Any:
+        """
+        :return: Object for interacting with Google API. Refer to the documentation for the
+            `discovery.build_from_document` function for more details on building API services in Python.
+        """
+        with self._service_lock:
+            if self._service is None:
+                document = self._load_discovery_document()
+                credentials = self._get_credentials()
+                # requests are executed with clients of the pool, this one is never used
+                self._service = discovery.build_from_document(document, http=credentials.authorize(Http()))
+            return self._service
+
+    def _acquire_client(self) -> tuple[client.OAuth2Credentials, Http]:
+        credentials = self._get_credentials()
+        while True:
+            try:
+                client_credentials, http = self._idle_clients.get_nowait()
+            except queue.Empty:
+                return credentials, credentials.authorize(Http())
+            # clients of replaced credentials are dropped
+            if client_credentials is credentials:
+                return credentials, http
+
+    def _release_client(self, credentials: client.OAuth2Credentials, http: Http) -> None:
+        if self._idle_clients.qsize() < self.pool_size:
+            self._idle_clients.put((credentials, http))
+
+    def _execute(self, build_request: Callable[[Any], HttpRequest]) -> dict:
+        service = self._get_service()
+        credentials, http = self._acquire_client()
+        try:
+            return build_request(service).execute(http=http)
+        finally:
+            self._release_client(credentials, http)
+
+    async def execute(self, build_request: Callable[[Any], HttpRequest]) -> dict:
+        """
+        Executes the request in a thread, so the event loop is not blocked.
+        :param build_request: Function that builds the request with the service,
+            e.g. `lambda service: service.forms().get(formId=form_id)`.
+        :return: Response of the request.
+        """
+        return await asyncio.to_thread(self._execute, build_request)
+
+
+forms_service = FormsService()
@@ -0,0 +1,41 @@
+import aiohttp
+
+from examobot.definitions import FORMS_HTTP_LIMIT_PER_HOST, FORMS_HTTP_TIMEOUT, FORMS_HTTP_CONNECT_TIMEOUT
+
+# how long resolved hosts and idle connections are kept, in seconds
+DNS_CACHE_TTL = 5 * 60
+KEEPALIVE_TIMEOUT = 60
+
+
+class HTTPSession:
+    """
+    Shared `aiohttp.ClientSession` for requests to Google Forms: connections are kept alive
+    and reused, resolved hosts are cached and at most `FORMS_HTTP_LIMIT_PER_HOST` connections
+    are open to a host at once.
+    The session is created on first use (or on startup) and has to be closed on shutdown.
+    """
+
+    def __init__(self) -> None:
+        self._session: aiohttp.ClientSession | None = None
+
+    async def start(self) -> None:
+        self.get()
+
+    def get(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=FORMS_HTTP_LIMIT_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            timeout = aiohttp.ClientTimeout(total=FORMS_HTTP_TIMEOUT, connect=FORMS_HTTP_CONNECT_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+forms_http_session = HTTPSession()
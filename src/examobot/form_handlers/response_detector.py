@@ -0,0 +1,141 @@
+import asyncio
+
+from lxml import html
+
+from examobot.form_handlers.exceptions import HTMLParseError
+
+# size of chunks in which the page is read from the response, in bytes
+CHUNK_SIZE = 16 * 1024
+
+# classes of the container with "Your response has been recorded"
+CONFIRMATION_CLASSES = ("freebirdFormviewerViewResponseConfirmationMessage", "vHW8K")
+# a class is looked for only in `class` attributes (the styles in the head mention all of them)
+# that are not longer than this
+MAX_CLASS_ATTRIBUTE_LENGTH = 256
+
+_FORM_TAGS = (b"<form", b"<FORM")
+_SCRIPT_TAGS = (b"<script", b"<SCRIPT")
+_SCRIPT_END_TAGS = (b"</script", b"</SCRIPT")
+_TAG_NAME_ENDS = b" \t\r\n>/"
+_CLASS_ATTRIBUTE = b'class="'
+_CLASS_NAME_ENDS = b' "'
+_CONFIRMATION_CLASSES = tuple(name.encode() for name in CONFIRMATION_CLASSES)
+# a marker that starts in one chunk and ends in the next one fits in this many last bytes of the first
+_MAX_MARKER_LENGTH = len(_CLASS_ATTRIBUTE) + MAX_CLASS_ATTRIBUTE_LENGTH + max(map(len, _CONFIRMATION_CLASSES)) + 1
+
+
+def _find_tag(data: bytes, tags: tuple[bytes, ...], start: int = 0) -> int:
+    found = -1
+    for tag in tags:
+        position = data.find(tag, start)
+        while position != -1:
+            end = position + len(tag)
+            if end < len(data) and data[end] in _TAG_NAME_ENDS:
+                if found == -1 or position < found:
+                    found = position
+                break
+            position = data.find(tag, position + 1)
+    return found
+
+
+def _find_confirmation(data: bytes) -> int:
+    found = -1
+    for name in _CONFIRMATION_CLASSES:
+        start = data.find(name)
+        while start != -1:
+            end = start + len(name)
+            attribute_start = data.rfind(_CLASS_ATTRIBUTE, max(0, start - MAX_CLASS_ATTRIBUTE_LENGTH), start)
+            if (attribute_start != -1
+                    and start > 0 and data[start - 1] in _CLASS_NAME_ENDS
+                    and end < len(data) and data[end] in _CLASS_NAME_ENDS
+                    and b'"' not in data[attribute_start + len(_CLASS_ATTRIBUTE):start]):
+                if found == -1 or start < found:
+                    found = start
+                break
+            start = data.find(name, start + 1)
+    return found
+
+
+def _has_no_forms(page: bytes) -> bool:
+    """
+    The whole page parsed into a tree and searched for forms.
+    """
+    try:
+        forms = html.fromstring(page).xpath('//form')
+    except Exception as e:
+        raise HTMLParseError(page.decode(errors="replace")) from e
+    return not forms
+
+
+class SubmissionPageDetector:
+    """
+    Determines if answers were accepted by the page Google Forms returns after sending them,
+    without parsing it: the page with marks on what was wrong has the form inside,
+    the page telling that the form is complete doesn't.
+
+    The page is fed by chunks while it is downloaded, the rest of it is not needed
+    once a form tag or the confirmation container is found. Inline scripts are skipped,
+    they may have markup in their strings. If neither marker is found, the page is parsed
+    in a thread, so the event loop isn't blocked.
+    """
+
+    def __init__(self) -> None:
+        self.result: bool | None = None
+        self.read = 0
+        self._tail = b""
+        self._in_script = False
+        # the page read so far, for parsing it when the markers are not found
+        self._chunks: list[bytes] = []
+
+    def feed(self, chunk: bytes) -> bool | None:
+        """
+        :return: Whether the answers were accepted, None if it is not clear yet.
+        """
+        if self.result is not None:
+            return self.result
+
+        self.read += len(chunk)
+        self._chunks.append(chunk)
+        data = self._tail + chunk
+        start = 0
+        while True:
+            if self._in_script:
+                end = min((position for position in (data.find(tag, start) for tag in _SCRIPT_END_TAGS)
+                           if position != -1), default=-1)
+                if end == -1:
+                    # the end tag may start at the end of the chunk
+                    self._tail = data[max(start, len(data) - len(_SCRIPT_END_TAGS[0]) + 1):]
+                    return None
+                start = end + len(_SCRIPT_END_TAGS[0])
+                self._in_script = False
+                continue
+
+            script = _find_tag(data, _SCRIPT_TAGS, start)
+            markup = data[start:script] if script != -1 else data[start:]
+            # plain searches of the markers are much faster than a regular expression or a parser
+            form = _find_tag(markup, _FORM_TAGS)
+            confirmation = _find_confirmation(markup)
+            if form != -1 or confirmation != -1:
+                self.result = form == -1 or confirmation != -1 and confirmation < form
+                self._chunks = []
+                return self.result
+
+            if script == -1:
+                self._tail = markup[-_MAX_MARKER_LENGTH:]
+                return None
+
+            start = script + len(_SCRIPT_TAGS[0])
+            self._in_script = True
+
+    async def finish(self) -> bool:
+        """
+        Call when the whole page is fed.
+        :return: Whether the answers were accepted.
+        :raises HTMLParseError: error that indicates that the page is empty or can't be parsed.
+        """
+        if self.result is None:
+            if not self.read:
+                raise HTMLParseError("")
+            self.result = await asyncio.to_thread(_has_no_forms, b"".join(self._chunks))
+            self._chunks = []
+        return self.result
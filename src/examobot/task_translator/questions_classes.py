@@ -1,11 +1,12 @@
 import urllib.parse
 from abc import ABC, abstractmethod
-from typing import Any, Callable, Generator
+from typing import Any, Generator
 
 from aiogram import Bot
 from aiogram.types import Message, CallbackQuery
 from aiogram.utils.markdown import hbold
 
+from examobot.bot.Button import CallbackData
 from examobot.db.manager import db_manager
 from examobot.db.tables import Answer, AnswerStatus
 from examobot.task_translator.task_keyboards import *
@@ -39,6 +40,15 @@ class FormResponseParameters:
         params.add_values(values, prefix=prefix)
         return params
 
+    @staticmethod
+    def from_values(values: list[dict[str, str]]) -> 'FormResponseParameters':
+        """
+        :param values: `values` of other parameters, e.g. loaded from JSON.
+        """
+        params = FormResponseParameters()
+        params.values = [dict(value) for value in values]
+        return params
+
 
 class Question(ABC):
     @staticmethod
@@ -58,26 +68,10 @@ class Question(ABC):
             values_to_replace: dict[str, Any],
             user_id: int,
             task_id: int,
-            answer_data_converter: Callable[[list[str]], list[str]] = None
     ) -> None:
-        existing_answer = await db_manager.get_answer_by_task_id_and_user_id(
+        await db_manager.upsert_answer(
             task_id=task_id,
-            user_id=user_id
-        )
-
-        if answer_data_converter:
-            values_to_replace["answer_data"] = answer_data_converter(
-                existing_answer.answer_data if existing_answer else []
-            )
-
-        if not existing_answer:
-            answer = Answer(**values_to_replace, task_id=task_id, user_id=user_id)
-            await db_manager.add_answer(answer)
-            return
-
-        await db_manager.update_answer_by_id(
-            answer_id=existing_answer.id,
-            dispatch_number=(existing_answer.dispatch_number + 1),
+            user_id=user_id,
             **values_to_replace
         )
 
@@ -101,21 +95,34 @@ class Question(ABC):
 
     @staticmethod
     @abstractmethod
-    async def save_answer(user_ans: Message | CallbackQuery, task_id: int) -> None:
+    async def save_answer(
+            user_ans: Message | CallbackQuery, task_id: int, callback_data: CallbackData | None = None
+    ) -> None:
         """
         convert user answer message or callback from user to Answer table object
+        :param callback_data: Decoded data of `user_ans` if it is a callback.
         """
         pass
 
     @staticmethod
     @abstractmethod
-    def convert_answer_to_string_repr(answer: Answer, task: Task) -> FormResponseParameters:
+    def convert_answer_to_string_repr(answer_data: list[str], options: list[str] | None) -> FormResponseParameters:
         """
             this method is needed to convert answer to string representation of answer
             to use in the link that we send to google form back
+            :param answer_data: `Answer.answer_data` of the answer.
+            :param options: `Task.options` of the task that was answered.
         """
         pass
 
+    @staticmethod
+    def get_options_keyboard(task: Task, answer: Answer | None) -> InlineKeyboardMarkup | None:
+        """
+        Keyboard with the answer options of the task where the chosen ones are marked,
+        None if the answer is sent as a message.
+        """
+        return None
+
     @staticmethod
     async def send_new_or_edit_message(
             bot: Bot, menu_message_id: int,
@@ -181,7 +188,9 @@ class StringOrTextQuestion(Question):
         return True
 
     @staticmethod
-    async def save_answer(user_ans: Message | CallbackQuery, task_id: int) -> None:
+    async def save_answer(
+            user_ans: Message | CallbackQuery, task_id: int, callback_data: CallbackData | None = None
+    ) -> None:
         if not isinstance(user_ans, Message):
             raise AssertionError(
                 f"user_ans expected as aiogram.types.Message, found: {type(user_ans)}")
@@ -197,9 +206,9 @@ class StringOrTextQuestion(Question):
         )
 
     @staticmethod
-    def convert_answer_to_string_repr(answer: Answer, task: Task) -> FormResponseParameters:
+    def convert_answer_to_string_repr(answer_data: list[str], options: list[str] | None) -> FormResponseParameters:
         params = FormResponseParameters(
-            urllib.parse.quote_plus(answer.answer_data[0])
+            urllib.parse.quote_plus(answer_data[0])
         )
         return params
 
@@ -216,10 +225,6 @@ class OneChoiceQuestion(Question):
             raise AssertionError("Expected answer options in this type of questions")
 
         answer = await db_manager.get_answer_by_task_id_and_user_id(task.id, user_id)
-        chosen_variant = -1 \
-            if not answer or answer.status == AnswerStatus.UNCHECKED \
-            else int(answer.answer_data[0])
-
         text = await Question.get_text_with_options(task, options)
         messages_to_delete = await Question.send_new_or_edit_message(
             bot=bot,
@@ -227,21 +232,30 @@ class OneChoiceQuestion(Question):
             task=task,
             user_id=user_id,
             text=text,
-            keyboard=get_one_choice_keyboard(task, len(options), chosen_variant)
+            keyboard=OneChoiceQuestion.get_options_keyboard(task, answer)
         )
         return messages_to_delete
 
+    @staticmethod
+    def get_options_keyboard(task: Task, answer: Answer | None) -> InlineKeyboardMarkup:
+        chosen_variant = -1 \
+            if not answer or answer.status == AnswerStatus.UNCHECKED \
+            else int(answer.answer_data[0])
+        return get_one_choice_keyboard(task, len(task.options), chosen_variant)
+
     @staticmethod
     def is_valid_answer(message: Message | None) -> bool:
         return True
 
     @staticmethod
-    async def save_answer(user_ans: Message | CallbackQuery, task_id: int) -> None:
+    async def save_answer(
+            user_ans: Message | CallbackQuery, task_id: int, callback_data: CallbackData | None = None
+    ) -> None:
         if not isinstance(user_ans, CallbackQuery):
             raise AssertionError(
                 f"user_ans expected as aiogram.CallbackQuery, found: {type(user_ans)}")
 
-        user_chosen_variant = user_ans.data.split('#')[-1]
+        user_chosen_variant = str(callback_data[-1])
         values = {
             "answer_data": [user_chosen_variant],
             "status": AnswerStatus.SAVED,
@@ -250,9 +264,9 @@ class OneChoiceQuestion(Question):
             values_to_replace=values, task_id=task_id, user_id=user_ans.from_user.id)
 
     @staticmethod
-    def convert_answer_to_string_repr(answer: Answer, task: Task) -> FormResponseParameters:
-        true_answer = task.options[
-            Question.get_index(answer.answer_data[0])
+    def convert_answer_to_string_repr(answer_data: list[str], options: list[str] | None) -> FormResponseParameters:
+        true_answer = options[
+            Question.get_index(answer_data[0])
         ]
         params = FormResponseParameters(
             urllib.parse.quote_plus(true_answer)
@@ -273,10 +287,6 @@ class MultipleChoiceQuestion(Question):
             raise AssertionError("Expected answer options in this type of questions")
 
         answer: Answer = await db_manager.get_answer_by_task_id_and_user_id(task.id, user_id)
-        chosen_options = [] \
-            if not answer or answer.status == AnswerStatus.UNCHECKED \
-            else [int(option) for option in answer.answer_data]
-
         text = await Question.get_text_with_options(task, options)
 
         messages_to_delete = await Question.send_new_or_edit_message(
@@ -285,45 +295,39 @@ class MultipleChoiceQuestion(Question):
             task=task,
             user_id=user_id,
             text=text,
-            keyboard=get_multiple_choice_keyboard(task, len(options), chosen_options)
+            keyboard=MultipleChoiceQuestion.get_options_keyboard(task, answer)
         )
         return messages_to_delete
 
+    @staticmethod
+    def get_options_keyboard(task: Task, answer: Answer | None) -> InlineKeyboardMarkup:
+        chosen_options = [] \
+            if not answer or answer.status == AnswerStatus.UNCHECKED \
+            else [int(option) for option in answer.answer_data]
+        return get_multiple_choice_keyboard(task, len(task.options), chosen_options)
+
     @staticmethod
     def is_valid_answer(message: Message | None) -> bool:
         return True
 
     @staticmethod
-    async def save_answer(user_ans: Message | CallbackQuery, task_id: int) -> None:
+    async def save_answer(
+            user_ans: Message | CallbackQuery, task_id: int, callback_data: CallbackData | None = None
+    ) -> None:
         if not isinstance(user_ans, CallbackQuery):
             raise AssertionError(f"user_ans expected as CallbackQuery, found: {type(user_ans)}")
 
-        new_chosen_option = user_ans.data.split("#")[-1]
-
-        def convert_answer_data(data: list[str]) -> list[str]:
-            data_set = set(data)
-            if new_chosen_option in data_set:
-                data_set.remove(new_chosen_option)
-            else:
-                data_set.add(new_chosen_option)
-
-            return list(data_set)
-
-        values = {
-            "answer_data": [],
-            "status": AnswerStatus.SAVED,
-        }
-        await Question.check_answer_and_save(
-            values_to_replace=values,
+        new_chosen_option = str(callback_data[-1])
+        await db_manager.toggle_answer_option(
             task_id=task_id,
             user_id=user_ans.from_user.id,
-            answer_data_converter=convert_answer_data
+            option=new_chosen_option,
+            status=AnswerStatus.SAVED
         )
 
     @staticmethod
-    def convert_answer_to_string_repr(answer: Answer, task: Task) -> FormResponseParameters:
-        task_options = task.options
-        true_answers = [task_options[Question.get_index(i)] for i in answer.answer_data]
+    def convert_answer_to_string_repr(answer_data: list[str], options: list[str] | None) -> FormResponseParameters:
+        true_answers = [options[Question.get_index(i)] for i in answer_data]
         return FormResponseParameters.from_string_list(
             [urllib.parse.quote_plus(ans) for ans in true_answers]
         )
@@ -3,22 +3,12 @@ import logging
 import sys
 
 from aiogram import Bot
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
 
+from examobot.bot.edit_deduplication import unchanged_edits_middleware
 from examobot.bot.examobot_main import dp
-from examobot.definitions import TOKEN
-
-
-class EngineManager:
-    def __init__(self, path: str) -> None:
-        self.path = path
-
-    async def __aenter__(self) -> AsyncEngine:
-        self.engine = create_async_engine(self.path, echo=True)
-        return self.engine
-
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.engine.dispose()
+from examobot.bot.webhook import run_webhook
+from examobot.db.manager import db_manager
+from examobot.definitions import TOKEN, BOT_MODE
 
 
 async def main() -> None:
@@ -28,8 +18,20 @@ async def main() -> None:
     #     else:
     #         logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
+    await db_manager.init_()
+
     bot = Bot(token=TOKEN, parse_mode="HTML")
-    await dp.start_polling(bot)
+    bot.session.middleware(unchanged_edits_middleware)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # getUpdates doesn't work while a webhook is set
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        logging.info(f"Message edits: {unchanged_edits_middleware.stats()}")
+        await db_manager.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,14 @@
+from sqlalchemy.dialects import postgresql
+
+from examobot.db.manager import DBManager
+from examobot.db.tables import AnswerStatus
+
+
+def test_toggle_answer_option_query_compiles():
+    query = DBManager._toggle_answer_option_query(task_id=1, user_id=2, option="Вариант 1", status=AnswerStatus.CHOSEN)
+    sql = str(query.compile(dialect=postgresql.dialect()))
+
+    assert "ON CONFLICT ON CONSTRAINT uq_answers_user_id_task_id DO UPDATE" in sql
+    assert "= ANY (answers.answer_data)" in sql
+    assert "array_remove(answers.answer_data" in sql
+    assert "array_append(answers.answer_data" in sql
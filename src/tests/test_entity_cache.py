@@ -0,0 +1,37 @@
+import asyncio
+
+from examobot.db.cache import EntityCache
+from examobot.db.tables import Task
+
+
+def _load_twice(cache: EntityCache) -> int:
+    loads = 0
+
+    async def loader() -> Task:
+        nonlocal loads
+        loads += 1
+        return Task(id=1, test_id=1)
+
+    async def run() -> None:
+        await cache.get_or_load(1, loader)
+        await cache.get_or_load(1, loader)
+
+    asyncio.run(run())
+    return loads
+
+
+def test_cache_of_single_process_loads_once():
+    cache = EntityCache(maxsize=10, ttl=300, processes=1)
+    assert _load_twice(cache) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_cache_is_off_for_several_processes():
+    cache = EntityCache(maxsize=10, ttl=300, processes=2)
+    assert _load_twice(cache) == 2
+    assert cache.stats() == {"hits": 0, "misses": 2, "size": 0}
+
+
+def test_cache_is_off_with_zero_ttl():
+    cache = EntityCache(maxsize=10, ttl=0, processes=1)
+    assert _load_twice(cache) == 2
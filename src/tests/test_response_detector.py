@@ -0,0 +1,79 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from examobot.form_handlers.exceptions import HTMLParseError
+from examobot.form_handlers.response_detector import SubmissionPageDetector, CHUNK_SIZE
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "form_responses"
+RECORDED_PAGES = [
+    pytest.param(path, expected, id=f"{kind}/{path.name}")
+    for kind, expected in (("success", True), ("failure", False))
+    for path in sorted((FIXTURES_DIR / kind).glob("*.html"))
+]
+
+
+def _detect(page: bytes, chunk_size: int) -> bool:
+    detector = SubmissionPageDetector()
+    for start in range(0, len(page), chunk_size):
+        if detector.feed(page[start:start + chunk_size]) is not None:
+            break
+    return asyncio.run(detector.finish())
+
+
+def _detect_split(page: bytes, split_at: bytes) -> bool:
+    """
+    Feeds the page in two chunks, the second one starting in the middle of `split_at`.
+    """
+    middle = page.index(split_at) + len(split_at) // 2
+    detector = SubmissionPageDetector()
+    if detector.feed(page[:middle]) is None:
+        detector.feed(page[middle:])
+    return asyncio.run(detector.finish())
+
+
+def test_pages_are_recorded():
+    kinds = {param.id.split("/")[0] for param in RECORDED_PAGES}
+    assert kinds == {"success", "failure"}
+
+
+@pytest.mark.parametrize("path, expected", RECORDED_PAGES)
+@pytest.mark.parametrize("chunk_size", [64, 1024, CHUNK_SIZE])
+def test_recorded_page(path: Path, expected: bool, chunk_size: int):
+    assert _detect(path.read_bytes(), chunk_size) == expected
+
+
+@pytest.mark.parametrize("split_at", [b'class="vHW8K"', b"vHW8K"])
+def test_confirmation_split_between_chunks(split_at: bytes):
+    page = b'<html><body><div class="Uc2NEf"><div class="vHW8K">Recorded</div></div></body></html>'
+    assert _detect_split(page, split_at) is True
+
+
+def test_form_tag_split_between_chunks():
+    page = b'<html><body><form action="formResponse" method="POST"><input name="entry.1"></form></body></html>'
+    assert _detect_split(page, b"<form ") is False
+
+
+def test_form_in_inline_script():
+    page = (b'<html><head><script>var t = "<form action=\\"\\"></form>";</script></head>'
+            b'<body><div class="vHW8K">Recorded</div></body></html>')
+    assert _detect(page, CHUNK_SIZE) is True
+    assert _detect_split(page, b"<form") is True
+    assert _detect_split(page, b"</script>") is True
+
+
+def test_confirmation_in_inline_script():
+    page = (b'<html><head><script>var t = \'<div class="vHW8K"></div>\';</script></head>'
+            b'<body><form action="formResponse"><input name="entry.1"></form></body></html>')
+    assert _detect(page, CHUNK_SIZE) is False
+
+
+def test_page_without_markers_is_parsed():
+    assert _detect(b"<html><body><p>Recorded</p></body></html>", CHUNK_SIZE) is True
+    assert _detect(b"<html><body><FoRm action='formResponse'></FoRm></body></html>", CHUNK_SIZE) is False
+
+
+def test_empty_page():
+    with pytest.raises(HTMLParseError):
+        asyncio.run(SubmissionPageDetector().finish())